@@ -1,3 +1,5 @@
+from zoneinfo import available_timezones
+
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth import get_user_model
 from django.contrib.auth import password_validation
@@ -308,7 +310,12 @@ class UpdateProfileSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CustomUser
-        fields = ['full_name', 'email', 'phone_number', 'profile_picture', 'old_password', 'new_password']
+        fields = ['full_name', 'email', 'phone_number', 'profile_picture', 'timezone', 'old_password', 'new_password']
+
+    def validate_timezone(self, value):
+        if value and value not in available_timezones():
+            raise serializers.ValidationError("Unknown time zone.")
+        return value
 
     def validate(self, attrs):
         user = self.instance
@@ -331,6 +338,7 @@ class UpdateProfileSerializer(serializers.ModelSerializer):
         instance.email = validated_data.get('email', instance.email)
         instance.phone_number = validated_data.get('phone_number', instance.phone_number)
         instance.profile_picture = validated_data.get('profile_picture', instance.profile_picture)
+        instance.timezone = validated_data.get('timezone', instance.timezone)
 
         old_password = validated_data.get('old_password')
         new_password = validated_data.get('new_password')
@@ -367,6 +375,7 @@ class UserDetailSerializer(serializers.ModelSerializer):
                   'full_name',
                   'phone_number',
                   'profile_picture',
+                  'timezone',
                   'is_active',
                   'is_superuser'
                   ]
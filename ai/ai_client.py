@@ -0,0 +1,297 @@
+import io
+import os
+import time
+import uuid
+import random
+import asyncio
+import weakref
+import threading
+import httpx
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from asgiref.sync import sync_to_async
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from django.conf import settings
+
+from .circuit_breaker import ai_breaker
+from .endpoint_pool import ai_endpoints
+from .metrics import add_phase, phase_total
+
+
+class AIServiceUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "AI service is temporarily unavailable. Please try again."
+    default_code = "ai_service_unavailable"
+
+
+RETRY_STATUSES = (502, 503, 504)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class TimedHTTPConnection(HTTPConnection):
+    # Reused keep-alive connections never get here, so a warm pool shows ~0
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            add_phase("ai_connect", time.perf_counter() - started)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            add_phase("ai_connect", time.perf_counter() - started)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+def _build_session():
+    # The AI service has no side effects (same image -> same analysis), so a
+    # POST is safe to resend on connection failures and gateway errors.
+    # Read timeouts are not retried: the node already spent the time on it.
+    # read=False raises them as ReadTimeout rather than a ConnectionError
+    # wrapping the exhausted retry, so analyze_image can tell them apart.
+    retry = Retry(
+        total=settings.AI_MAX_RETRIES,
+        connect=settings.AI_MAX_RETRIES,
+        read=False,
+        status=settings.AI_MAX_RETRIES,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"POST"}),
+        backoff_factor=settings.AI_RETRY_BACKOFF,
+        backoff_jitter=settings.AI_RETRY_JITTER,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=max(1, len(settings.AI_ENDPOINTS)),
+        pool_maxsize=settings.AI_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    adapter.poolmanager.pool_classes_by_scheme = {
+        "http": TimedHTTPConnectionPool,
+        "https": TimedHTTPSConnectionPool,
+    }
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    """
+    Return the process-wide keep-alive session for the AI backend.
+
+    Built lazily and rebuilt after a fork, so gunicorn and celery prefork
+    workers never share sockets with their parent.
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+class MultipartFileStream:
+    """
+    multipart/form-data body for a single file that is read from the file in
+    chunks as it is sent, instead of being assembled in memory the way
+    requests' `files=` does. Seekable, so urllib3 can rewind it on retries.
+    """
+
+    def __init__(self, field, name, fileobj, content_type):
+        self.boundary = uuid.uuid4().hex
+        filename = (name or "image").replace('"', "%22")
+        head = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type or 'application/octet-stream'}\r\n\r\n"
+        ).encode()
+        tail = f"\r\n--{self.boundary}--\r\n".encode()
+
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+        self._parts = [(io.BytesIO(head), len(head)), (fileobj, size), (io.BytesIO(tail), len(tail))]
+        self._length = len(head) + size + len(tail)
+        self.seek(0)
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self._length
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence != os.SEEK_SET:
+            raise io.UnsupportedOperation("only absolute seeks are supported")
+        self._pos = offset
+        for part, size in self._parts:
+            part.seek(min(max(offset, 0), size))
+            offset -= size
+        return self._pos
+
+    def read(self, size=-1):
+        chunks = []
+        for part, _ in self._parts:
+            if size == 0:
+                break
+            chunk = part.read(size)
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        data = b"".join(chunks)
+        self._pos += len(data)
+        return data
+
+
+def analyze_image(name, content, content_type):
+    """
+    Send one image to an AI endpoint and return the raw response.
+
+    `content` may be bytes or a seekable file, which is streamed from disk.
+    Raises CircuitOpen without calling out while the AI circuit is open.
+    Retries stay on the chosen endpoint; when it cannot be reached at all
+    the call fails over to up to AI_ENDPOINT_FAILOVER other endpoints. A
+    read timeout is not failed over: the image is not sent again after a
+    node has already spent AI_READ_TIMEOUT on it.
+    """
+    if isinstance(content, bytes):
+        content = io.BytesIO(content)
+    body = MultipartFileStream("file", name, content, content_type)
+    max_endpoints = min(len(settings.AI_ENDPOINTS), settings.AI_ENDPOINT_FAILOVER + 1)
+
+    probe = ai_breaker.before_call()
+    started = time.monotonic()
+    tried = []
+    while True:
+        url, token = ai_endpoints.acquire(exclude=tried)
+        tried.append(url)
+        call_started = time.monotonic()
+        connect_before = phase_total("ai_connect")
+        try:
+            response = get_session().post(
+                url,
+                data=body,
+                headers={"Content-Type": body.content_type},
+                timeout=(settings.AI_CONNECT_TIMEOUT, settings.AI_READ_TIMEOUT),
+            )
+        except requests.RequestException as exc:
+            ai_endpoints.release(url, token, False, time.monotonic() - call_started)
+            add_phase("ai_ttfb", time.monotonic() - call_started - (phase_total("ai_connect") - connect_before))
+            # ConnectionError includes ConnectTimeout, but not ReadTimeout
+            if isinstance(exc, requests.ConnectionError) and len(tried) < max_endpoints:
+                body.seek(0)
+                continue
+            ai_breaker.record(False, time.monotonic() - started, probe)
+            raise AIServiceUnavailable()
+
+        call_time = time.monotonic() - call_started
+        ai_endpoints.release(url, token, response.status_code < 500, call_time)
+        # `elapsed` runs from sending the request to parsing the response
+        # headers; the rest of the call is reading the body
+        headers_at = response.elapsed.total_seconds()
+        add_phase("ai_ttfb", headers_at - (phase_total("ai_connect") - connect_before))
+        add_phase("ai_transfer", max(0, call_time - headers_at))
+        break
+
+    ai_breaker.record(response.status_code < 500, time.monotonic() - started, probe)
+    return response
+
+
+# httpx clients are bound to the event loop that opened their connections,
+# so keep one per loop (a single one under uvicorn).
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.AI_READ_TIMEOUT, connect=settings.AI_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.AI_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.AI_ASYNC_MAX_CONNECTIONS,
+            ),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def analyze_image_async(name, content, content_type):
+    """
+    Async twin of analyze_image with the same timeout, retry and circuit
+    breaker policy.
+    """
+    # The breaker talks to Redis synchronously; keep that off the event loop
+    probe = await sync_to_async(ai_breaker.before_call, thread_sensitive=False)()
+    record = sync_to_async(ai_breaker.record, thread_sensitive=False)
+    started = time.monotonic()
+    try:
+        response = await _post_with_retries(name, content, content_type)
+    except AIServiceUnavailable:
+        await record(False, time.monotonic() - started, probe)
+        raise
+
+    await record(response.status_code < 500, time.monotonic() - started, probe)
+    return response
+
+
+async def _post_with_retries(name, content, content_type):
+    # httpx streams file objects in `files=` and rewinds them on each attempt.
+    # Every attempt picks an endpoint, preferring ones not tried yet.
+    client = get_async_client()
+    acquire = sync_to_async(ai_endpoints.acquire, thread_sensitive=False)
+    release = sync_to_async(ai_endpoints.release, thread_sensitive=False)
+    attempts = settings.AI_MAX_RETRIES + 1
+    tried = []
+
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        url, token = await acquire(exclude=tried)
+        tried.append(url)
+        call_started = time.monotonic()
+        try:
+            response = await client.post(
+                url,
+                files={"file": (name, content, content_type)},
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            await release(url, token, False, time.monotonic() - call_started)
+            if last_attempt:
+                raise AIServiceUnavailable()
+        except httpx.HTTPError:
+            await release(url, token, False, time.monotonic() - call_started)
+            raise AIServiceUnavailable()
+        else:
+            await release(url, token, response.status_code < 500, time.monotonic() - call_started)
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                return response
+
+        delay = settings.AI_RETRY_BACKOFF * (2 ** attempt)
+        await asyncio.sleep(delay + random.uniform(0, settings.AI_RETRY_JITTER))
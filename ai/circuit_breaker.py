@@ -0,0 +1,156 @@
+import math
+import time
+import logging
+
+import redis
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "AI service is overloaded. Please try again shortly."
+    default_code = "circuit_open"
+
+    def __init__(self, retry_after):
+        super().__init__()
+        # DRF turns `wait` into a Retry-After header
+        self.wait = max(1, math.ceil(retry_after))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker whose state lives in Redis, so every gunicorn worker and
+    container sees the same verdict about a dependency.
+
+    Calls are counted in AI_BREAKER_BUCKET_SECONDS buckets; when the last
+    AI_BREAKER_WINDOW_SECONDS hold at least AI_BREAKER_MIN_CALLS and either
+    the error rate or the slow-call rate crosses its threshold, the circuit
+    opens and calls fail immediately for AI_BREAKER_OPEN_SECONDS. After that
+    a single probe call is let through (half-open): success closes the
+    circuit, failure opens it again.
+
+    If Redis itself is unreachable the breaker stays out of the way.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.prefix = f"breaker:{name}"
+
+    @property
+    def client(self):
+        return settings.REDIS_CLIENT
+
+    def _key(self, suffix):
+        return f"{self.prefix}:{suffix}"
+
+    def _buckets(self, now):
+        size = settings.AI_BREAKER_BUCKET_SECONDS
+        current = int(now // size)
+        count = max(1, settings.AI_BREAKER_WINDOW_SECONDS // size)
+        return [self._key(f"window:{bucket}") for bucket in range(current - count + 1, current + 1)]
+
+    def _transition(self, old, new):
+        pipe = self.client.pipeline()
+        pipe.set(self._key("state"), new)
+        if new == OPEN:
+            pipe.set(self._key("opened-at"), time.time())
+        if new == CLOSED:
+            pipe.delete(*self._buckets(time.time()))
+        pipe.hincrby(self._key("transitions"), f"{old}->{new}", 1)
+        pipe.execute()
+        logger.warning("Circuit breaker %s: %s -> %s", self.name, old, new)
+
+    def state(self):
+        try:
+            return self.client.get(self._key("state")) or CLOSED
+        except redis.RedisError:
+            return CLOSED
+
+    def before_call(self):
+        """
+        Raise CircuitOpen when calls are refused. Returns True when this call
+        is the half-open probe and must be reported with `probe=True`.
+        """
+        try:
+            state, opened_at = self.client.mget(self._key("state"), self._key("opened-at"))
+            if state in (None, CLOSED):
+                return False
+
+            cooldown = settings.AI_BREAKER_OPEN_SECONDS
+            remaining = cooldown - (time.time() - float(opened_at or 0))
+            if state == OPEN and remaining > 0:
+                raise CircuitOpen(remaining)
+
+            # Only one caller across all workers gets to probe
+            probe_ttl = math.ceil(settings.AI_CONNECT_TIMEOUT + settings.AI_READ_TIMEOUT)
+            if not self.client.set(self._key("probe"), 1, nx=True, ex=probe_ttl):
+                raise CircuitOpen(cooldown)
+            if state == OPEN:
+                self._transition(OPEN, HALF_OPEN)
+            return True
+        except redis.RedisError:
+            logger.warning("Circuit breaker %s: Redis unavailable", self.name, exc_info=True)
+            return False
+
+    def record(self, success, duration, probe=False):
+        """
+        Report the outcome of a call let through by before_call().
+        """
+        slow = duration > settings.AI_BREAKER_SLOW_CALL_SECONDS
+        try:
+            if probe:
+                self._transition(HALF_OPEN, CLOSED if success and not slow else OPEN)
+                self.client.delete(self._key("probe"))
+                return
+
+            now = time.time()
+            buckets = self._buckets(now)
+            pipe = self.client.pipeline()
+            pipe.hincrby(buckets[-1], "calls", 1)
+            if not success:
+                pipe.hincrby(buckets[-1], "errors", 1)
+            if slow:
+                pipe.hincrby(buckets[-1], "slow", 1)
+            pipe.expire(buckets[-1], settings.AI_BREAKER_WINDOW_SECONDS + settings.AI_BREAKER_BUCKET_SECONDS)
+            pipe.execute()
+
+            # A healthy call can never trip the breaker
+            if success and not slow:
+                return
+
+            pipe = self.client.pipeline()
+            for bucket in buckets:
+                pipe.hgetall(bucket)
+            calls = errors = slow_calls = 0
+            for counts in pipe.execute():
+                calls += int(counts.get("calls", 0))
+                errors += int(counts.get("errors", 0))
+                slow_calls += int(counts.get("slow", 0))
+
+            if calls < settings.AI_BREAKER_MIN_CALLS:
+                return
+            if (
+                errors / calls >= settings.AI_BREAKER_ERROR_RATE
+                or slow_calls / calls >= settings.AI_BREAKER_SLOW_CALL_RATE
+            ):
+                if self.state() == CLOSED:
+                    self._transition(CLOSED, OPEN)
+        except redis.RedisError:
+            logger.warning("Circuit breaker %s: Redis unavailable", self.name, exc_info=True)
+
+    def transition_counts(self):
+        try:
+            return {key: int(value) for key, value in self.client.hgetall(self._key("transitions")).items()}
+        except redis.RedisError:
+            return {}
+
+
+ai_breaker = CircuitBreaker("ai")
@@ -0,0 +1,177 @@
+import time
+import uuid
+import random
+import hashlib
+import logging
+from urllib.parse import urljoin
+
+import redis
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+
+class EndpointPool:
+    """
+    Routes AI calls across the replicas in AI_ENDPOINTS.
+
+    Every call is registered in a per-endpoint Redis sorted set for as long
+    as it is in flight, so all workers pick the healthy endpoint with the
+    fewest outstanding requests. Entries older than the client timeout are
+    ignored, so a killed worker cannot leak load onto a node.
+
+    An endpoint is ejected for AI_ENDPOINT_EJECT_SECONDS after
+    AI_ENDPOINT_MAX_FAILURES consecutive failed or slow calls, or when its
+    active health check fails. The two are kept under separate keys: a
+    passing health check only lifts an ejection made by a health check,
+    since a node that is up but slow still answers its health path, so
+    failure ejections always run their full term. If every endpoint is
+    ejected, calls still go to the least loaded one and the circuit
+    breaker takes over.
+    """
+
+    def __init__(self, name):
+        self.prefix = f"endpoints:{name}"
+
+    @property
+    def client(self):
+        return settings.REDIS_CLIENT
+
+    @property
+    def urls(self):
+        return settings.AI_ENDPOINTS
+
+    def _key(self, url, suffix):
+        return f"{self.prefix}:{hashlib.sha1(url.encode()).hexdigest()[:12]}:{suffix}"
+
+    def _in_flight_horizon(self, now):
+        return now - (settings.AI_CONNECT_TIMEOUT + settings.AI_READ_TIMEOUT)
+
+    def acquire(self, exclude=()):
+        """
+        Pick an endpoint for one call. Returns (url, token); pass both to
+        release() once the call is over.
+        """
+        if not self.urls:
+            raise ImproperlyConfigured("Set AI_ENDPOINTS or BASE_URL_AI.")
+        urls = [url for url in self.urls if url not in exclude] or list(self.urls)
+        token = uuid.uuid4().hex
+        if len(self.urls) == 1:
+            return urls[0], token
+
+        now = time.time()
+        try:
+            pipe = self.client.pipeline()
+            for url in urls:
+                pipe.zremrangebyscore(self._key(url, "in-flight"), "-inf", self._in_flight_horizon(now))
+                pipe.zcard(self._key(url, "in-flight"))
+                pipe.exists(self._key(url, "ejected"), self._key(url, "unhealthy"))
+            replies = pipe.execute()
+
+            loads = [
+                (replies[i * 3 + 1], random.random(), url, replies[i * 3 + 2])
+                for i, url in enumerate(urls)
+            ]
+            candidates = [load for load in loads if not load[3]] or loads
+            url = min(candidates)[2]
+
+            key = self._key(url, "in-flight")
+            pipe = self.client.pipeline()
+            pipe.zadd(key, {token: now})
+            pipe.expire(key, int(settings.AI_CONNECT_TIMEOUT + settings.AI_READ_TIMEOUT) + 1)
+            pipe.execute()
+        except redis.RedisError:
+            logger.warning("Endpoint pool: Redis unavailable, routing at random", exc_info=True)
+            url = random.choice(urls)
+        return url, token
+
+    def release(self, url, token, success, duration):
+        """
+        Report how a call acquired from this pool went.
+        """
+        if len(self.urls) == 1:
+            return
+
+        healthy = success and duration <= settings.AI_ENDPOINT_SLOW_SECONDS
+        try:
+            pipe = self.client.pipeline()
+            pipe.zrem(self._key(url, "in-flight"), token)
+            if healthy:
+                pipe.delete(self._key(url, "failures"))
+                pipe.execute()
+                return
+            pipe.incr(self._key(url, "failures"))
+            pipe.expire(self._key(url, "failures"), settings.AI_ENDPOINT_EJECT_SECONDS)
+            _, failures, _ = pipe.execute()
+            if failures >= settings.AI_ENDPOINT_MAX_FAILURES:
+                self.eject(url, f"{failures} consecutive failed or slow calls")
+        except redis.RedisError:
+            logger.warning("Endpoint pool: Redis unavailable", exc_info=True)
+
+    def eject(self, url, reason, key="ejected"):
+        ejected = self.client.set(
+            self._key(url, key), reason, nx=True, ex=settings.AI_ENDPOINT_EJECT_SECONDS
+        )
+        if ejected:
+            logger.warning("Ejected AI endpoint %s: %s", url, reason)
+
+    def readmit(self, url):
+        """
+        Lift a health-check ejection; ejections for failed calls stay.
+        """
+        if self.client.delete(self._key(url, "unhealthy")):
+            logger.info("Readmitted AI endpoint %s", url)
+
+    def check_health(self):
+        """
+        Probe every endpoint's AI_HEALTH_CHECK_PATH. Any answer below 500
+        means the node is up and serving and lifts an earlier health-check
+        ejection; anything else ejects it.
+        """
+        for url in self.urls:
+            try:
+                response = requests.get(
+                    urljoin(url, settings.AI_HEALTH_CHECK_PATH),
+                    timeout=settings.AI_HEALTH_CHECK_TIMEOUT,
+                )
+                healthy = response.status_code < 500
+                reason = f"health check returned {response.status_code}"
+            except requests.RequestException as exc:
+                healthy = False
+                reason = f"health check failed: {exc.__class__.__name__}"
+
+            try:
+                if healthy:
+                    self.readmit(url)
+                else:
+                    self.eject(url, reason, key="unhealthy")
+            except redis.RedisError:
+                logger.warning("Endpoint pool: Redis unavailable", exc_info=True)
+                return
+
+    def status(self):
+        now = time.time()
+        try:
+            pipe = self.client.pipeline()
+            for url in self.urls:
+                pipe.zcount(self._key(url, "in-flight"), self._in_flight_horizon(now), "+inf")
+                pipe.get(self._key(url, "ejected"))
+                pipe.get(self._key(url, "unhealthy"))
+                pipe.get(self._key(url, "failures"))
+            replies = pipe.execute()
+        except redis.RedisError:
+            return []
+        return [
+            {
+                "url": url,
+                "in_flight": replies[i * 4],
+                "ejected": replies[i * 4 + 1] or replies[i * 4 + 2],
+                "consecutive_failures": int(replies[i * 4 + 3] or 0),
+            }
+            for i, url in enumerate(self.urls)
+        ]
+
+
+ai_endpoints = EndpointPool("ai")
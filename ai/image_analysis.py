@@ -1,71 +1,340 @@
-import os
-import requests
+from concurrent.futures import ThreadPoolExecutor
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status, permissions
+from rest_framework.exceptions import APIException, Throttled
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from .serializers import ImageAnalysisResultSerializer
-from payment.models import AnalysisCreditTransaction
-from payment.paymentpermission import HasActiveSubscription
-from django.db import transaction
-from django.utils import timezone
-from django.db.models import Q
-from ai.models import ImageAnalysisResult
+from . import result_cache
+from .ai_client import analyze_image, analyze_image_async
+from .metrics import ScanTimingMixin
+from .models import AnalysisJob, ImageAnalysisResult
+from .pipeline import AnalysisFailed, read_ai_response, save_analysis
+from .preprocessing import normalize_image
+from .result_cache import image_digest
+from .serializers import AnalysisJobSerializer, ImageAnalysisResultSerializer
+from .single_flight import scan_flights
+from .throttling import ScanRateLimitMixin, ScanRateThrottle, add_rate_limit_headers
+from .tasks import run_analysis_job
+from .upload_handlers import ImageUploadHandler, ImageUploadMixin
+from payment.models import CreditHold
+from payment.paymentpermission import HasActiveSubscription, SubscriptionRequired
+
+
+def coalesced_response(user, outcome):
+    """
+    (body, status) for a request that waited on an identical in-flight scan.
+    """
+    if "result" not in outcome:
+        return outcome["data"], outcome["status"]
+    result = get_object_or_404(
+        ImageAnalysisResult.objects.select_related("ratings", "user"), id=outcome["result"], user=user
+    )
+    return {
+        "message": "Image analyzed & saved",
+        "data": ImageAnalysisResultSerializer(result).data
+    }, status.HTTP_200_OK
 
 
-class ImageAnalysis(APIView):
+class ImageAnalysis(ScanTimingMixin, ScanRateLimitMixin, ImageUploadMixin, APIView):
     permission_classes = [permissions.IsAuthenticated, HasActiveSubscription]
 
     def post(self, request, *args, **kwargs):
+        timer = self.timer
+
+        with timer.phase("upload"):
+            image = request.FILES.get("image")
+            if not image:
+                return Response({"message": "No image provided"}, status=400)
+            digest = image_digest(image)
+
+        # Same photo re-uploaded after a flaky response: return the stored result
+        cached = result_cache.lookup(request.user, digest)
+        if cached is not None:
+            return Response({
+                "message": "Image analyzed & saved",
+                "data": ImageAnalysisResultSerializer(cached).data
+            })
+
+        # A double tap or client retry: wait for the scan already running
+        flight = f"{request.user.id}:{digest}"
+        token = scan_flights.lead(flight)
+        if token is None:
+            outcome = scan_flights.wait(flight)
+            if outcome is not None:
+                body, code = coalesced_response(request.user, outcome)
+                return Response(body, status=code)
+
+        hold = None
+        try:
+            # Reserve the credit up front so concurrent scans cannot overspend it
+            with timer.phase("access"):
+                hold = CreditHold.place(request.user)
+            if hold is None:
+                raise SubscriptionRequired()
+
+            with timer.phase("normalize"):
+                upload = normalize_image(image.name, image, image.content_type)
+            # analyze_image splits its time into ai_connect/ai_ttfb/ai_transfer
+            ai_response = analyze_image(*upload)
+
+            try:
+                with timer.phase("parse"):
+                    data = read_ai_response(ai_response)
+            except AnalysisFailed as exc:
+                scan_flights.publish(flight, token, {"status": exc.status, "data": exc.response_data})
+                return Response(exc.response_data, status=exc.status)
+
+            # Everything succeeded → now deduct safely
+            with timer.phase("db"):
+                result = save_analysis(request.user, data, digest=digest, hold=hold)
+            scan_flights.publish(flight, token, {"result": result.id})
+        finally:
+            if hold is not None:
+                hold.release()
+            scan_flights.release(flight, token)
+
+        return Response({
+            "message": "Image analyzed & saved",
+            "data": ImageAnalysisResultSerializer(result).data
+        })
+
+
+class BatchImageAnalysis(ScanRateLimitMixin, ImageUploadMixin, APIView):
+    """
+    Analyze several shots (e.g. front/left/right) sent as repeated `images`
+    fields in one request. The AI calls run concurrently, at most
+    AI_BATCH_CONCURRENCY at a time, and every successful result and its
+    credit are saved in one transaction. Each image reports its own outcome
+    and counts as one scan against the rate limits.
+    """
+    permission_classes = [permissions.IsAuthenticated, HasActiveSubscription]
+    upload_max_files = settings.AI_BATCH_MAX_IMAGES
+
+    def analyze(self, image):
+        # Runs on a pool thread: no database access in here
+        try:
+            ai_response = analyze_image(*normalize_image(image.name, image, image.content_type))
+            return read_ai_response(ai_response), None
+        except AnalysisFailed as exc:
+            return None, exc.response_data
+        except APIException as exc:
+            return None, {"message": str(exc.detail)}
+
+    def post(self, request, *args, **kwargs):
+        images = request.FILES.getlist("images")
+        if not images:
+            return Response({"message": "No images provided"}, status=400)
+
+        # The request was counted as one scan; each further image is another AI call
+        throttle = ScanRateThrottle()
+        if not throttle.consume(request, len(images) - 1):
+            raise Throttled(throttle.wait())
+
+        user = request.user
+        digests = [image_digest(image) for image in images]
+        results = [
+            {"index": index, "name": image.name}
+            for index, image in enumerate(images)
+        ]
+
+        pending = []
+        for index, digest in enumerate(digests):
+            cached = result_cache.lookup(user, digest)
+            if cached is not None:
+                results[index].update(status="succeeded", data=ImageAnalysisResultSerializer(cached).data)
+            else:
+                pending.append(index)
+
+        holds = []
+        try:
+            for _ in pending:
+                hold = CreditHold.place(user)
+                if hold is None:
+                    raise SubscriptionRequired(f"Not enough credits to analyze {len(pending)} images.")
+                holds.append(hold)
+
+            if pending:
+                workers = min(settings.AI_BATCH_CONCURRENCY, len(pending))
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    outcomes = list(pool.map(self.analyze, [images[index] for index in pending]))
 
+                with transaction.atomic():
+                    for index, (data, error), hold in zip(pending, outcomes, holds):
+                        if error is None:
+                            result = save_analysis(user, data, digest=digests[index], hold=hold)
+                            results[index].update(status="succeeded", data=ImageAnalysisResultSerializer(result).data)
+                        else:
+                            results[index].update(status="failed", **error)
+        finally:
+            # Credits of failed images go back, and all of them if the saves
+            # were rolled back; committed holds are already settled
+            for hold in holds:
+                hold.release()
+
+        return Response({
+            "message": "Images analyzed",
+            "results": results
+        })
+
+
+class AnalysisJobCreateView(ScanRateLimitMixin, ImageUploadMixin, APIView):
+    """
+    Queue an image for analysis and return its job id straight away.
+    Poll AnalysisJobStatusView for the result; the credit is charged by the
+    worker only once the result is saved.
+    """
+    permission_classes = [permissions.IsAuthenticated, HasActiveSubscription]
+
+    def post(self, request, *args, **kwargs):
         image = request.FILES.get("image")
         if not image:
             return Response({"message": "No image provided"}, status=400)
 
-        BASE_URL_AI = os.getenv("BASE_URL_AI")
+        digest = image_digest(image)
+        cached = result_cache.lookup(request.user, digest)
+        if cached is not None:
+            job = AnalysisJob.objects.create(
+                user=request.user, digest=digest, status="succeeded", result=cached
+            )
+        else:
+            job = AnalysisJob.objects.create(
+                user=request.user,
+                image=image,
+                content_type=image.content_type or "",
+                digest=digest,
+            )
+            transaction.on_commit(lambda: run_analysis_job.delay(str(job.id)))
+
+        return Response({
+            "message": "Image queued for analysis",
+            "job_id": job.id,
+            "status": job.status,
+        }, status=status.HTTP_202_ACCEPTED)
+
 
-        ai_response = requests.post(
-            BASE_URL_AI,
-            files={"file": (image.name, image.read(), image.content_type)}
+class AnalysisJobStatusView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, job_id, *args, **kwargs):
+        job = get_object_or_404(
+            AnalysisJob.objects.select_related("result__ratings", "result__user"),
+            id=job_id,
+            user=request.user,
         )
+        return Response(AnalysisJobSerializer(job).data)
 
-        if ai_response.status_code != 200:
-            return Response({
-                "message": "AI error",
-                "details": ai_response.text
-            }, status=500)
 
-        data = ai_response.json()
+class AsyncImageAnalysis(View):
+    """
+    Same contract as ImageAnalysis, but the AI round trip is awaited instead
+    of holding a worker thread. Only pays off when served by the ASGI stack
+    (see the `asgi` profile in docker-compose.yml).
+    """
 
-        if data.get("face") == 0:
-            return Response({
-                "message": "Invalid face. Please upload a real human face."
-            }, status=400)
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
 
-        # Everything succeeded → now deduct safely
-        AnalysisCreditTransaction.objects.create(
-            user=request.user,
-            credits=1,
-            type="use",
-            reason="Used for image analysis.",
+    def check_access(self, request):
+        auth = JWTAuthentication().authenticate(request)
+        if auth is None:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+        request.user = auth[0]
+        HasActiveSubscription().has_permission(request, self)
+        throttle = ScanRateThrottle()
+        if not throttle.allow_request(request, self):
+            raise Throttled(throttle.wait())
+        return None
+
+    def read_upload(self, request):
+        # Parses the multipart body, spooling the image to disk
+        request.upload_handlers = [ImageUploadHandler(request)]
+        return request.FILES.get("image")
+
+    def cached_result(self, user, digest):
+        cached = result_cache.lookup(user, digest)
+        if cached is None:
+            return None
+        return ImageAnalysisResultSerializer(cached).data
+
+    async def post(self, request, *args, **kwargs):
+        response = await self.scan(request)
+        return add_rate_limit_headers(request, response)
+
+    async def scan(self, request):
+        try:
+            denied = await sync_to_async(self.check_access)(request)
+            if denied is not None:
+                return denied
+
+            # Parsing and hashing up to the upload limit are blocking file
+            # work; keep them off the event loop like the Pillow work
+            image = await sync_to_async(self.read_upload, thread_sensitive=False)(request)
+            if not image:
+                return JsonResponse({"message": "No image provided"}, status=400)
+
+            digest = await sync_to_async(image_digest, thread_sensitive=False)(image)
+            cached = await sync_to_async(self.cached_result)(request.user, digest)
+            if cached is not None:
+                return JsonResponse({
+                    "message": "Image analyzed & saved",
+                    "data": cached
+                })
+
+            flight = f"{request.user.id}:{digest}"
+            token = await sync_to_async(scan_flights.lead, thread_sensitive=False)(flight)
+            if token is None:
+                outcome = await scan_flights.wait_async(flight)
+                if outcome is not None:
+                    body, code = await sync_to_async(coalesced_response)(request.user, outcome)
+                    return JsonResponse(body, status=code)
+
+            hold = None
+            try:
+                hold = await sync_to_async(CreditHold.place)(request.user)
+                if hold is None:
+                    raise SubscriptionRequired()
+                return await self.analyze(request, image, digest, flight, token, hold)
+            finally:
+                if hold is not None:
+                    await sync_to_async(hold.release)()
+                await sync_to_async(scan_flights.release, thread_sensitive=False)(flight, token)
+        except APIException as exc:
+            response = JsonResponse({"detail": exc.detail}, status=exc.status_code)
+            if getattr(exc, "wait", None):
+                response["Retry-After"] = "%d" % exc.wait
+            return response
+
+    async def analyze(self, request, image, digest, flight, token, hold):
+        # Pillow work is CPU-bound; keep it off the event loop
+        upload = await sync_to_async(normalize_image, thread_sensitive=False)(
+            image.name, image, image.content_type
         )
+        ai_response = await analyze_image_async(*upload)
 
-        payload = {
-                "user": request.user.id,
-                "face": data["face"],
-                "ratings": data["ratings"],
-                "key_strengths": data["key_strengths"],
-                "exercise_guidance": data["exercise_guidance"],
-                "ai_recommendations": data["ai_recommendations"],
-            }
+        publish = sync_to_async(scan_flights.publish, thread_sensitive=False)
+        try:
+            data = read_ai_response(ai_response)
+        except AnalysisFailed as exc:
+            await publish(flight, token, {"status": exc.status, "data": exc.response_data})
+            return JsonResponse(exc.response_data, status=exc.status)
 
-        serializer = ImageAnalysisResultSerializer(data=payload)
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+        result = await sync_to_async(save_analysis)(request.user, data, digest=digest, hold=hold)
+        await publish(flight, token, {"result": result.id})
 
-        return Response({
+        return JsonResponse({
             "message": "Image analyzed & saved",
-            "data": serializer.data
+            "data": ImageAnalysisResultSerializer(result).data
         })
-
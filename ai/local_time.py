@@ -0,0 +1,43 @@
+from datetime import datetime, time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.utils import timezone
+
+
+def user_timezone(user):
+    """
+    The user's own time zone, or the default (TIME_ZONE) if unset or unknown.
+    """
+    name = getattr(user, "timezone", "")
+    if name:
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            pass
+    return timezone.get_default_timezone()
+
+
+def day_start(date):
+    """
+    The aware datetime at which the local `date` begins, in the current
+    time zone. Compare created_at against these instead of using __date,
+    which wraps the column in a conversion and rules out its index.
+    """
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+class UserTimezoneMixin:
+    """
+    Make the authenticated user's time zone the current one for the
+    request, so "today" and "this month" are the user's local ones.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        timezone.activate(user_timezone(request.user))
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            timezone.deactivate()
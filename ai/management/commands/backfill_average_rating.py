@@ -0,0 +1,42 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from ai.models import AnalysisStats, ImageAnalysisResult, Ratings, ratings_average
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill ImageAnalysisResult.average_rating for analyses saved before the column "
+        "existed, and rebuild the AnalysisStats of their users."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        pending = ImageAnalysisResult.objects.filter(average_rating=None)
+        average = Subquery(Ratings.objects.filter(pk=OuterRef("ratings_id")).values(average=ratings_average())[:1])
+
+        filled = 0
+        users = set()
+        while True:
+            # Short batches, so writers are never blocked for long
+            with transaction.atomic():
+                batch = list(pending.order_by("pk").values_list("pk", "user_id")[:options["batch_size"]])
+                if not batch:
+                    break
+                filled += ImageAnalysisResult.objects.filter(pk__in=[pk for pk, _ in batch]).update(average_rating=average)
+            users.update(user_id for _, user_id in batch if user_id is not None)
+
+        # Rows built while the column was still empty
+        stale = get_user_model().objects.filter(pk__in=users, analysis_stats__isnull=False)
+        for user in stale.iterator():
+            with transaction.atomic():
+                AnalysisStats.objects.select_for_update().filter(user=user).first()
+                AnalysisStats.build(user)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Filled average_rating on {filled} analyses."
+        ))
@@ -0,0 +1,236 @@
+import io
+import os
+import time
+import queue
+import random
+import tempfile
+import threading
+import statistics
+from collections import Counter, defaultdict
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count, Q, Sum
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment
+from django.urls import reverse
+from PIL import Image, ImageDraw
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ai.models import ImageAnalysisResult
+from ai.stub_ai import StubAIConfig, StubAIServer, add_stub_arguments
+from accounts.models import CustomUser
+from payment.models import AnalysisCreditTransaction, CreditBalance
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def make_image(rng, edge):
+    """
+    A distinct JPEG so every upload has its own digest, with enough grain
+    to pass the quality gate's sharpness check like a real photo.
+    """
+    img = Image.new("RGB", (edge * 3 // 4, edge), tuple(rng.randrange(64, 192) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(8):
+        x, y = rng.randrange(img.width), rng.randrange(img.height)
+        r = rng.randrange(10, edge // 4)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(64, 192) for _ in range(3)))
+    img = Image.blend(img, Image.effect_noise(img.size, 64).convert("RGB"), 0.2)
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test analyze-image/ end to end against a throwaway test database "
+        "and a local stub AI backend, then check the credit ledger."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument("--users", type=int, default=5)
+        parser.add_argument(
+            "--credits", type=int, default=None,
+            help="Credits bought per user (default: enough for every request).",
+        )
+        parser.add_argument("--image-edge", type=int, default=1024, help="Long edge of the generated photos.")
+        parser.add_argument(
+            "--repeat-rate", type=float, default=0.0,
+            help="Fraction of uploads that re-send one of the user's earlier photos.",
+        )
+        parser.add_argument("--ai-url", default=None, help="Use this AI backend instead of the built-in stub.")
+        parser.add_argument(
+            "--rate-limits", action="store_true", help="Keep the AI_SCAN_RATE_* limits (off by default)."
+        )
+        add_stub_arguments(parser)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        db_file = None
+        if connection.vendor == "sqlite":
+            # A file (not shared memory) so concurrent writers wait on the lock instead of failing
+            fd, db_file = tempfile.mkstemp(suffix=".sqlite3", prefix="loadtest-")
+            os.close(fd)
+            connection.settings_dict["TEST"]["NAME"] = db_file
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        server = None
+        ai_url = options["ai_url"]
+        if not ai_url:
+            server = StubAIServer(StubAIConfig.from_options(options))
+            server.start()
+            ai_url = server.url
+
+        try:
+            limits = {} if options["rate_limits"] else {"AI_SCAN_RATE_USER": "", "AI_SCAN_RATE_GLOBAL": ""}
+            with override_settings(AI_ENDPOINTS=[ai_url], **limits):
+                self.run(options)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if db_file and os.path.exists(db_file):
+                os.remove(db_file)
+
+    def run(self, options):
+        total = options["requests"]
+        user_count = max(1, options["users"])
+        credits = options["credits"]
+        if credits is None:
+            credits = -(-total // user_count)
+
+        rng = random.Random(options["seed"])
+        users = []
+        for i in range(user_count):
+            user = CustomUser.objects.create_user(
+                f"loadtest{i}@example.com", f"Load Test {i}", "", "loadtest", is_active=True
+            )
+            AnalysisCreditTransaction.objects.create(
+                user=user, credits=credits, type="purchase", reason="Load test"
+            )
+            users.append((user, f"Bearer {AccessToken.for_user(user)}"))
+
+        # Build every upload before the clock starts
+        work = queue.Queue()
+        sent = defaultdict(list)
+        for i in range(total):
+            user, token = users[i % user_count]
+            if sent[user.pk] and rng.random() < options["repeat_rate"]:
+                image = rng.choice(sent[user.pk])
+            else:
+                image = make_image(rng, options["image_edge"])
+                sent[user.pk].append(image)
+            work.put((user.pk, token, image))
+
+        url = reverse("analyze-image")
+        samples = []
+        lock = threading.Lock()
+
+        def worker():
+            client = Client()
+            try:
+                while True:
+                    try:
+                        user_id, token, image = work.get_nowait()
+                    except queue.Empty:
+                        return
+                    upload = SimpleUploadedFile("scan.jpg", image, content_type="image/jpeg")
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        response = client.post(url, {"image": upload}, HTTP_AUTHORIZATION=token)
+                        elapsed = time.perf_counter() - started
+                    with lock:
+                        samples.append((user_id, response.status_code, elapsed, len(queries)))
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(max(1, options["concurrency"]))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        self.report(samples, wall, options)
+        if not self.check_ledger(samples, users, credits):
+            raise CommandError("Credit ledger is inconsistent.")
+
+    def report(self, samples, wall, options):
+        latencies = [elapsed * 1000 for _, _, elapsed, _ in samples]
+        query_counts = [count for _, _, _, count in samples]
+        statuses = Counter(status for _, status, _, _ in samples)
+
+        self.stdout.write(
+            f"Requests:    {len(samples)} in {wall:.2f} s "
+            f"({len(samples) / wall:.1f} req/s, concurrency {options['concurrency']})"
+        )
+        self.stdout.write(
+            "Statuses:    " + ", ".join(f"{status} x {count}" for status, count in sorted(statuses.items()))
+        )
+        self.stdout.write(
+            f"Latency ms:  p50 {percentile(latencies, 50):.1f}  p95 {percentile(latencies, 95):.1f}  "
+            f"p99 {percentile(latencies, 99):.1f}  max {max(latencies, default=0):.1f}"
+        )
+        self.stdout.write(
+            f"DB queries:  mean {statistics.fmean(query_counts) if query_counts else 0:.1f}  "
+            f"p95 {percentile(query_counts, 95)}  max {max(query_counts, default=0)}"
+        )
+
+    def check_ledger(self, samples, users, credits):
+        """
+        Every stored result must be paid for by exactly one "use" credit,
+        only successful responses may store results, no balance may go
+        below zero, and the maintained balance must match the ledger with
+        no credits left on hold.
+        """
+        ok_responses = Counter(user_id for user_id, status, _, _ in samples if status == 200)
+        results = dict(
+            ImageAnalysisResult.objects.filter(user__in=[user for user, _ in users])
+            .values_list("user").annotate(count=Count("id"))
+        )
+        uses = dict(
+            AnalysisCreditTransaction.objects.filter(user__in=[user for user, _ in users])
+            .values_list("user")
+            .annotate(total=Sum("credits", filter=Q(type="use"), default=0))
+        )
+
+        balances = {
+            user_id: (balance, held)
+            for user_id, balance, held in CreditBalance.objects.filter(
+                user__in=[user for user, _ in users]
+            ).values_list("user_id", "balance", "held")
+        }
+
+        consistent = True
+        for user, _ in users:
+            stored = results.get(user.pk, 0)
+            used = uses.get(user.pk, 0)
+            balance = credits - used
+            problems = []
+            if used != stored:
+                problems.append(f"{used} credits used for {stored} results")
+            if stored > ok_responses[user.pk]:
+                problems.append(f"{stored} results from {ok_responses[user.pk]} successful responses")
+            if balance < 0:
+                problems.append(f"balance {balance}")
+            if balances.get(user.pk, (balance, 0)) != (balance, 0):
+                problems.append("stored balance {} with {} held".format(*balances[user.pk]))
+            if problems:
+                consistent = False
+                self.stdout.write(self.style.ERROR(f"Ledger {user.email}: " + "; ".join(problems)))
+
+        if consistent:
+            self.stdout.write(self.style.SUCCESS("Ledger:      consistent"))
+        return consistent
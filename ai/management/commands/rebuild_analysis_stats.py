@@ -0,0 +1,32 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ai.models import AnalysisStats, ImageAnalysisResult
+
+
+class Command(BaseCommand):
+    help = "Recompute every user's AnalysisStats row from their ImageAnalysisResult history."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", type=int, action="append", dest="users",
+            help="Only rebuild this user id (repeatable).",
+        )
+
+    def handle(self, *args, **options):
+        users = options["users"]
+        if not users:
+            users = set(
+                ImageAnalysisResult.objects.exclude(user=None).values_list("user_id", flat=True).distinct()
+            ) | set(AnalysisStats.objects.values_list("user_id", flat=True))
+
+        rebuilt = 0
+        for user in get_user_model().objects.filter(pk__in=users).order_by("pk").iterator():
+            with transaction.atomic():
+                # Hold off concurrent saves while the history is replayed
+                AnalysisStats.objects.select_for_update().filter(user=user).first()
+                AnalysisStats.build(user)
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt statistics for {rebuilt} user(s)."))
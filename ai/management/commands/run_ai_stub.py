@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from ai.stub_ai import StubAIConfig, StubAIServer, add_stub_arguments
+
+
+class Command(BaseCommand):
+    help = "Run a local fake of the AI backend (point BASE_URL_AI or AI_ENDPOINTS at it)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+        add_stub_arguments(parser)
+
+    def handle(self, *args, **options):
+        server = StubAIServer(StubAIConfig.from_options(options), options["host"], options["port"])
+        self.stdout.write(f"Stub AI backend listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
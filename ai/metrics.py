@@ -0,0 +1,200 @@
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# The PhaseTimer of the scan being handled on this thread, if any
+current_timer = contextvars.ContextVar("scan_timer", default=None)
+
+
+class PhaseTimer:
+    """
+    Wall time spent in each named phase of one request, and byte counts
+    (e.g. the image before and after normalization).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.sizes = {}
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def add_size(self, name, size):
+        self.sizes[name] = self.sizes.get(name, 0) + size
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        timings = dict(self.phases, total=self.elapsed())
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+        entries += [f'{name};desc="{size}"' for name, size in self.sizes.items()]
+        return ", ".join(entries)
+
+
+def add_phase(name, seconds):
+    timer = current_timer.get()
+    if timer is not None:
+        timer.add(name, seconds)
+
+
+def add_size(name, size):
+    timer = current_timer.get()
+    if timer is not None:
+        timer.add_size(name, size)
+
+
+def phase_total(name):
+    timer = current_timer.get()
+    return timer.phases.get(name, 0) if timer is not None else 0
+
+
+class Histograms:
+    """
+    Latency histograms per phase, kept in Redis so every worker feeds the
+    same numbers. Each phase is a hash of bucket counts plus `count` and
+    `sum` (milliseconds). Byte counts are summed in one more hash.
+    """
+
+    def __init__(self, name):
+        self.prefix = f"metrics:{name}"
+
+    @property
+    def client(self):
+        return settings.REDIS_CLIENT
+
+    @property
+    def _sizes_key(self):
+        # Outside the `prefix:*` pattern summary() scans
+        return f"{self.prefix}-bytes"
+
+    def observe(self, phases, sizes=None):
+        try:
+            pipe = self.client.pipeline()
+            for name, seconds in phases.items():
+                ms = seconds * 1000
+                bucket = next((str(bound) for bound in BUCKETS_MS if ms <= bound), "+Inf")
+                key = f"{self.prefix}:{name}"
+                pipe.hincrby(key, bucket, 1)
+                pipe.hincrby(key, "count", 1)
+                pipe.hincrbyfloat(key, "sum", ms)
+            if sizes:
+                pipe.hincrby(self._sizes_key, "count", 1)
+                for name, size in sizes.items():
+                    pipe.hincrby(self._sizes_key, name, size)
+            pipe.execute()
+        except redis.RedisError:
+            logger.warning("Scan metrics: Redis unavailable", exc_info=True)
+
+    @staticmethod
+    def _quantile(buckets, count, q):
+        # Linear interpolation inside the bucket holding the q-th observation
+        rank = q * count
+        lower = 0
+        for bound, cumulative, in_bucket in buckets:
+            if cumulative >= rank:
+                if bound is None:
+                    return lower
+                return lower + (bound - lower) * (1 - (cumulative - rank) / in_bucket)
+            lower = bound
+        return lower
+
+    def summary(self):
+        try:
+            names = sorted(key[len(self.prefix) + 1:] for key in self.client.scan_iter(f"{self.prefix}:*"))
+            pipe = self.client.pipeline()
+            for name in names:
+                pipe.hgetall(f"{self.prefix}:{name}")
+            hashes = pipe.execute()
+        except redis.RedisError:
+            return {}
+
+        summary = {}
+        for name, values in zip(names, hashes):
+            count = int(values.get("count", 0))
+            if not count:
+                continue
+            buckets = []
+            cumulative = 0
+            for bound in BUCKETS_MS + (None,):
+                in_bucket = int(values.get(str(bound) if bound else "+Inf", 0))
+                cumulative += in_bucket
+                buckets.append((bound, cumulative, in_bucket))
+            summary[name] = {
+                "count": count,
+                "mean_ms": round(float(values.get("sum", 0)) / count, 1),
+                "p50_ms": round(self._quantile(buckets, count, 0.5), 1),
+                "p95_ms": round(self._quantile(buckets, count, 0.95), 1),
+                "p99_ms": round(self._quantile(buckets, count, 0.99), 1),
+                "buckets": {str(bound) if bound else "+Inf": cumulative for bound, cumulative, _ in buckets},
+            }
+        return summary
+
+    def sizes(self):
+        """
+        Total and mean bytes per request of each byte count observed.
+        """
+        try:
+            values = self.client.hgetall(self._sizes_key)
+        except redis.RedisError:
+            return {}
+        count = int(values.pop("count", 0))
+        if not count:
+            return {}
+        return {
+            name: {"total": int(total), "mean": round(int(total) / count)}
+            for name, total in values.items()
+        }
+
+
+scan_metrics = Histograms("ai-scan")
+
+
+class ScanTimingMixin:
+    """
+    Time the phases of a scan request into scan_metrics. "access" covers
+    authentication, permission, throttling and the credit hold, "total"
+    the whole request; views add their own phases with self.timer.phase().
+
+    Staff users sending `X-Debug-Timing: 1` get the phases and byte counts
+    back in a Server-Timing header.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        self.timer = PhaseTimer()
+        token = current_timer.set(self.timer)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            current_timer.reset(token)
+            self.timer.add("total", self.timer.elapsed())
+            scan_metrics.observe(self.timer.phases, self.timer.sizes)
+
+    def initial(self, request, *args, **kwargs):
+        with self.timer.phase("access"):
+            super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        user = getattr(request, "user", None)
+        if user is not None and user.is_staff and request.META.get("HTTP_X_DEBUG_TIMING"):
+            response["Server-Timing"] = self.timer.server_timing()
+        return response
@@ -1,8 +1,39 @@
-from django.db import models
+import uuid
+import weakref
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q, Sum
+from django.db.models.functions import Coalesce, Floor, TruncMonth
+from django.utils import timezone
+
+from .local_time import day_start, user_timezone
+from .response_cache import dashboard_cache
 
 User = get_user_model()
 
+# The metrics averaged into a scan's overall score
+AVERAGED_METRICS = ("skin_quality", "jawline_definition", "cheekbone_structure", "eye_area", "facial_proportions")
+RATING_METRICS = AVERAGED_METRICS + ("symmetry", "goals")
+
+
+def ratings_average(prefix=""):
+    """
+    Ratings.average() in SQL, over Ratings fields reached through `prefix`
+    (e.g. "ratings__" from ImageAnalysisResult).
+    """
+    return ExpressionWrapper(
+        sum((F(f"{prefix}{name}") for name in AVERAGED_METRICS[1:]), F(f"{prefix}{AVERAGED_METRICS[0]}"))
+        / float(len(AVERAGED_METRICS)),
+        output_field=FloatField(),
+    )
+
+
+# An analysis's average rating, computed from its Ratings for rows saved
+# before the average_rating column existed and not backfilled yet
+AVERAGE_RATING = Coalesce("average_rating", ratings_average("ratings__"))
+
 
 class Ratings(models.Model):
     skin_quality = models.FloatField()
@@ -16,6 +47,9 @@ class Ratings(models.Model):
     def __str__(self):
         return f"Ratings (SQ={self.skin_quality})"
 
+    def average(self):
+        return sum(float(getattr(self, name) or 0) for name in AVERAGED_METRICS) / len(AVERAGED_METRICS)
+
 
 class ImageAnalysisResult(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
@@ -26,7 +60,264 @@ class ImageAnalysisResult(models.Model):
     key_strengths = models.JSONField(default=list)
     exercise_guidance = models.JSONField(default=list)
     ai_recommendations = models.JSONField(default=list)
+    # Ratings.average(), stored so scores can be filtered and sorted in SQL
+    average_rating = models.FloatField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Per-user time ranges (created_at__gte/__lt on local day boundaries)
+            models.Index(fields=["user", "created_at"], name="analysis_user_created_idx"),
+            models.Index(fields=["user", "average_rating", "created_at"], name="analysis_user_score_idx"),
+        ]
+
     def __str__(self):
         return f"Analysis Result (Face={self.face})"
+
+    def save(self, *args, **kwargs):
+        self.average_rating = self.ratings.average()
+        # The user's statistics move in the same transaction as the insert
+        with transaction.atomic(savepoint=False):
+            adding = self._state.adding
+            super().save(*args, **kwargs)
+            if adding and self.user_id is not None:
+                AnalysisStats.record(self)
+                user_id = self.user_id
+                transaction.on_commit(lambda: dashboard_cache.invalidate(user_id))
+
+
+class AnalysisJob(models.Model):
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("succeeded", "Succeeded"),
+        ("failed", "Failed"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="analysis_jobs")
+    # Shared with the celery workers through the media volume; removed once the job finishes
+    image = models.FileField(upload_to="analysis_jobs/", blank=True)
+    content_type = models.CharField(max_length=100, blank=True, default="")
+    digest = models.CharField(max_length=64, blank=True, default="")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    # A re-uploaded image resolves to the result of the earlier job
+    result = models.ForeignKey(
+        ImageAnalysisResult, on_delete=models.SET_NULL, null=True, blank=True, related_name="jobs"
+    )
+    error = models.CharField(max_length=255, blank=True, default="")
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Analysis Job {self.id} ({self.status})"
+
+
+# Width of the average-rating ranges AnalysisStats counts scans in
+SCORE_BUCKET_WIDTH = 0.5
+
+
+def score_buckets(results, width=SCORE_BUCKET_WIDTH):
+    """
+    [(range start, scans)] of the `results` queryset grouped by average
+    rating into ranges `width` wide, lowest first. One GROUP BY query;
+    empty ranges are left out.
+    """
+    rows = (
+        results.values(bucket=Floor(AVERAGE_RATING / width))
+        .annotate(scans=Count("id"))
+        .order_by("bucket")
+        .values_list("bucket", "scans")
+    )
+    return [(round(bucket * width, 4), scans) for bucket, scans in rows]
+
+
+class AnalysisStats(models.Model):
+    """
+    Running statistics of a user's ImageAnalysisResults, so the dashboard
+    endpoints read one row instead of walking the whole history. Each new
+    result is added by ImageAnalysisResult.save() in the same transaction;
+    any delete rebuilds the row from the history (see analysis_deleted).
+    Created on first use; `manage.py rebuild_analysis_stats` recomputes
+    every row.
+
+    Months and days are local dates in the user's time zone, recorded in
+    `time_zone`; the row is rebuilt when the user changes it.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="analysis_stats")
+    scans = models.PositiveIntegerField(default=0)
+    # {"2025-01": {"scans": 4, "goals": 23.5}}: scans and sum of goals per month
+    months = models.JSONField(default=dict)
+    # Sum of every rating metric over all scans
+    metric_sums = models.JSONField(default=dict)
+    # {"6.5": 3}: scans whose average rating lies in [6.5, 7.0), see SCORE_BUCKET_WIDTH
+    score_buckets = models.JSONField(default=dict)
+    latest = models.ForeignKey(
+        ImageAnalysisResult, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    latest_average = models.FloatField(null=True, blank=True)
+    previous_average = models.FloatField(null=True, blank=True)
+    previous_symmetry = models.FloatField(null=True, blank=True)
+    # Sum of the average ratings of every scan before the latest
+    earlier_average_sum = models.FloatField(default=0)
+    day = models.DateField(null=True, blank=True)
+    day_scans = models.PositiveIntegerField(default=0)
+    time_zone = models.CharField(max_length=64, blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user} - {self.scans} scans"
+
+    def add(self, result):
+        """
+        Count `result`, the user's newest analysis, in the statistics.
+        """
+        ratings = result.ratings
+        average = result.average_rating
+        created = timezone.localdate(result.created_at)
+
+        month = self.months.setdefault(created.strftime("%Y-%m"), {"scans": 0, "goals": 0})
+        month["scans"] += 1
+        month["goals"] += ratings.goals
+        for name in RATING_METRICS:
+            self.metric_sums[name] = self.metric_sums.get(name, 0) + getattr(ratings, name)
+        bucket = str(int(average / SCORE_BUCKET_WIDTH) * SCORE_BUCKET_WIDTH)
+        self.score_buckets[bucket] = self.score_buckets.get(bucket, 0) + 1
+
+        if self.latest_average is not None:
+            self.earlier_average_sum += self.latest_average
+            self.previous_average = self.latest_average
+            self.previous_symmetry = self.latest.ratings.symmetry if self.latest else None
+        self.latest = result
+        self.latest_average = average
+
+        if self.day != created:
+            self.day, self.day_scans = created, 0
+        self.day_scans += 1
+        self.scans += 1
+
+    @classmethod
+    def record(cls, result):
+        user = result.user
+        stats = cls.objects.select_for_update().select_related("latest__ratings").filter(user=user).first()
+        if stats is None or stats.time_zone != str(user_timezone(user)):
+            # Built from the history, which already includes `result`
+            cls.build(user)
+            return
+        with timezone.override(stats.time_zone):
+            stats.add(result)
+        stats.save()
+
+    @classmethod
+    def build(cls, user):
+        """
+        Recompute the user's row from their whole history and return it.
+        A fixed number of aggregate queries, however long the history is.
+        """
+        tz = user_timezone(user)
+        with timezone.override(tz):
+            stats = cls._compute(user.pk)
+        stats.time_zone = str(tz)
+        try:
+            with transaction.atomic():
+                stats.save()
+        except IntegrityError:
+            # Created concurrently from the same history
+            return cls.objects.select_related("latest__ratings").get(user=user)
+        return stats
+
+    @staticmethod
+    def _average(result):
+        if result.average_rating is None:
+            return result.ratings.average()
+        return result.average_rating
+
+    @classmethod
+    def _compute(cls, user_id):
+        stats = cls(user_id=user_id)
+        results = ImageAnalysisResult.objects.filter(user_id=user_id)
+
+        latest = list(results.select_related("ratings").order_by("-created_at", "-id")[:2])
+        if latest:
+            stats.latest = latest[0]
+            stats.latest_average = cls._average(latest[0])
+            if len(latest) > 1:
+                stats.previous_average = cls._average(latest[1])
+                stats.previous_symmetry = latest[1].ratings.symmetry
+            stats.day = timezone.localdate(stats.latest.created_at)
+
+            totals = results.aggregate(
+                scans=Count("id"),
+                earlier_average_sum=Sum(AVERAGE_RATING, filter=~Q(pk=stats.latest.pk), default=0),
+                day_scans=Count("id", filter=Q(created_at__gte=day_start(stats.day))),
+                **{name: Sum(f"ratings__{name}") for name in RATING_METRICS},
+            )
+            stats.scans = totals.pop("scans")
+            stats.earlier_average_sum = totals.pop("earlier_average_sum")
+            stats.day_scans = totals.pop("day_scans")
+            stats.metric_sums = totals
+
+            months = (
+                results.values(month=TruncMonth("created_at"))
+                .annotate(scans=Count("id"), goals=Sum("ratings__goals"))
+                .values_list("month", "scans", "goals")
+            )
+            stats.months = {
+                month.strftime("%Y-%m"): {"scans": scans, "goals": goals}
+                for month, scans, goals in months
+            }
+
+            stats.score_buckets = {str(start): scans for start, scans in score_buckets(results)}
+        return stats
+
+    @classmethod
+    def for_user(cls, user):
+        stats = cls.objects.select_related("latest__ratings").filter(user=user).first()
+        if stats is None or stats.time_zone != str(user_timezone(user)):
+            stats = cls.build(user)
+        return stats
+
+    def month_scans(self, date):
+        return self.months.get(date.strftime("%Y-%m"), {}).get("scans", 0)
+
+    def month_goals(self, date):
+        """
+        Average goals score of the scans in the month of `date`, or 0.
+        """
+        month = self.months.get(date.strftime("%Y-%m"))
+        return round(month["goals"] / month["scans"], 2) if month else 0
+
+    def metric_average(self, name):
+        return round(self.metric_sums[name] / self.scans, 2) if self.scans else 0
+
+    def today_scans(self):
+        return self.day_scans if self.day == timezone.localdate() else 0
+
+
+# Users already rebuilt, per delete() call (the instance or queryset it started from)
+_rebuilt_for = weakref.WeakKeyDictionary()
+
+
+@receiver(post_delete, sender=ImageAnalysisResult)
+def analysis_deleted(sender, instance, origin=None, **kwargs):
+    """
+    Rebuild the user's AnalysisStats after their analyses are deleted, in
+    the delete's transaction, and invalidate their cached dashboard
+    responses once it commits: instance.delete(), queryset deletes and
+    cascades (e.g. from Ratings) alike. Django sends the signals once the
+    whole batch is gone, so each user is handled once per delete() call.
+    Nothing is done when the delete started from the user themselves.
+    """
+    user_id = instance.user_id
+    if user_id is None or isinstance(origin, User) or getattr(origin, "model", None) is User:
+        return
+    try:
+        rebuilt = _rebuilt_for.setdefault(origin, set())
+    except TypeError:
+        rebuilt = set()
+    if user_id in rebuilt:
+        return
+    rebuilt.add(user_id)
+    AnalysisStats.build(instance.user)
+    transaction.on_commit(lambda: dashboard_cache.invalidate(user_id))
@@ -0,0 +1,90 @@
+import logging
+
+from django.db import transaction
+from pydantic import ValidationError
+
+from payment.models import AnalysisCreditTransaction
+from . import result_cache
+from .models import ImageAnalysisResult, Ratings
+from .schemas import AIAnalysis
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisFailed(Exception):
+    """
+    The AI backend answered, but not with an analysis we can save.
+    """
+
+    def __init__(self, message, status=400, details=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.details = details
+
+    @property
+    def response_data(self):
+        data = {"message": self.message}
+        if self.details is not None:
+            data["details"] = self.details
+        return data
+
+
+def read_ai_response(ai_response):
+    """
+    Return the AIAnalysis parsed from an AI response or raise AnalysisFailed.
+    The raw body is validated in one pass, with no intermediate dict.
+    """
+    if ai_response.status_code != 200:
+        raise AnalysisFailed("AI error", status=500, details=ai_response.text)
+
+    try:
+        analysis = AIAnalysis.model_validate_json(ai_response.content)
+    except ValidationError as exc:
+        logger.warning("Unexpected AI response: %s", exc)
+        raise AnalysisFailed("AI error", status=500, details=ai_response.text)
+
+    if analysis.face == 0:
+        raise AnalysisFailed("Invalid face. Please upload a real human face.")
+    if analysis.ratings is None:
+        raise AnalysisFailed("AI error", status=500, details=ai_response.text)
+
+    return analysis
+
+
+def save_analysis(user, analysis, digest=None, hold=None):
+    """
+    Charge one credit and store the AIAnalysis for `user`.
+
+    The analysis was validated by read_ai_response, so this is just the
+    INSERTs (ratings, result, credit use) in one transaction: a failed save
+    never leaves the user charged for an analysis they cannot see. The
+    credit comes from `hold` (a CreditHold placed before the AI call) when
+    given. When the image `digest` is given, the result is cached so a
+    re-upload of the same file is served without another AI call or
+    charge. Returns the saved ImageAnalysisResult.
+    """
+    with transaction.atomic():
+        ratings = Ratings.objects.create(**analysis.ratings.model_dump())
+        result = ImageAnalysisResult.objects.create(
+            user=user,
+            face=analysis.face,
+            ratings=ratings,
+            key_strengths=analysis.key_strengths,
+            exercise_guidance=analysis.exercise_guidance,
+            ai_recommendations=analysis.ai_recommendations,
+        )
+        if hold is not None:
+            hold.commit()
+        else:
+            AnalysisCreditTransaction.objects.create(
+                user=user,
+                credits=1,
+                type="use",
+                reason="Used for image analysis.",
+            )
+
+        if digest:
+            transaction.on_commit(lambda: result_cache.store(user, digest, result.id))
+
+    return result
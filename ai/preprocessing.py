@@ -0,0 +1,108 @@
+import io
+import os
+import time
+import logging
+
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .metrics import add_size
+from .quality_gate import check_quality
+
+logger = logging.getLogger(__name__)
+
+# Image.info keys of a JPEG's EXIF, XMP, ICC, Photoshop and comment segments
+METADATA_KEYS = ("exif", "xmp", "icc_profile", "photoshop", "comment")
+
+
+class InvalidImage(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "Image is too large to process."
+    default_code = "invalid_image"
+
+
+def needs_encoding(img, max_edge):
+    """
+    Whether the opened (not yet decoded) image has to be re-encoded: it is
+    not an RGB JPEG, is larger than `max_edge`, or carries metadata (EXIF,
+    and with it any orientation, among it).
+    """
+    return (
+        img.format != "JPEG"
+        or img.mode != "RGB"
+        or max(img.size) > max_edge
+        or any(key in img.info for key in METADATA_KEYS)
+    )
+
+
+def normalize_image(name, fileobj, content_type):
+    """
+    Prepare an upload for the AI backend: apply the EXIF orientation, drop
+    all metadata, shrink the longest edge to AI_IMAGE_MAX_EDGE and re-encode
+    as JPEG at AI_IMAGE_JPEG_QUALITY. A JPEG that is already within the
+    edge and has no metadata is forwarded as it is, since re-encoding would
+    only cost CPU and quality. With AI_QUALITY_GATE on, unusable photos are
+    rejected first (see check_quality). The bytes in and out are recorded
+    on the scan's timer as image_bytes_in/image_bytes_out.
+
+    `fileobj` is read in place (no copy of the upload). Returns the
+    (name, content, content_type) to forward, where content is the
+    re-encoded bytes or the rewound original file: passed through, or in a
+    format Pillow cannot read and left to the AI backend.
+    """
+    fileobj.seek(0)
+    if not (settings.AI_IMAGE_NORMALIZE or settings.AI_QUALITY_GATE):
+        return name, fileobj, content_type
+
+    started = time.perf_counter()
+    max_edge = settings.AI_IMAGE_MAX_EDGE
+    bytes_in = fileobj.seek(0, os.SEEK_END)
+    fileobj.seek(0)
+    add_size("image_bytes_in", bytes_in)
+
+    try:
+        with Image.open(fileobj) as img:
+            original_size = img.size
+            passthrough = not (settings.AI_IMAGE_NORMALIZE and needs_encoding(img, max_edge))
+            if passthrough and not settings.AI_QUALITY_GATE:
+                fileobj.seek(0)
+                add_size("image_bytes_out", bytes_in)
+                return name, fileobj, content_type
+
+            # Let the JPEG decoder scale down by 1/2..1/8 while decoding
+            img.draft("RGB", (max_edge, max_edge))
+            img = ImageOps.exif_transpose(img)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            if settings.AI_QUALITY_GATE:
+                check_quality(img, original_size)
+            if passthrough:
+                fileobj.seek(0)
+                add_size("image_bytes_out", bytes_in)
+                return name, fileobj, content_type
+
+            output = io.BytesIO()
+            img.save(output, format="JPEG", quality=settings.AI_IMAGE_JPEG_QUALITY)
+            size = img.size
+    except Image.DecompressionBombError:
+        raise InvalidImage()
+    except (UnidentifiedImageError, OSError):
+        logger.info("Forwarding %s unchanged: not readable by Pillow", content_type)
+        fileobj.seek(0)
+        add_size("image_bytes_out", bytes_in)
+        return name, fileobj, content_type
+
+    normalized = output.getvalue()
+    add_size("image_bytes_out", len(normalized))
+    logger.info(
+        "Normalized upload %sx%s -> %sx%s, %s -> %s bytes in %.1f ms",
+        original_size[0], original_size[1], size[0], size[1],
+        bytes_in, len(normalized), (time.perf_counter() - started) * 1000,
+    )
+
+    base, _ = os.path.splitext(name or "image")
+    return f"{base}.jpg", normalized, "image/jpeg"
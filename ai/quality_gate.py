@@ -0,0 +1,75 @@
+import logging
+
+from django.conf import settings
+from PIL import ImageFilter, ImageStat
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cv2
+    import numpy
+except ImportError:  # face pre-check is optional
+    cv2 = None
+
+LAPLACIAN = ImageFilter.Kernel((3, 3), (0, 1, 0, 1, -4, 1, 0, 1, 0), scale=1, offset=128)
+# Sharpness and exposure are measured at roughly this size so thresholds do not depend on the upload
+MEASURE_EDGE = 512
+
+_face_detector = None
+
+
+class UnusableImage(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "Photo is not usable for analysis."
+    default_code = "unusable_image"
+
+
+def _detect_face(gray):
+    global _face_detector
+    if _face_detector is None:
+        _face_detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    faces = _face_detector.detectMultiScale(
+        numpy.asarray(gray), scaleFactor=1.2, minNeighbors=4, minSize=(MEASURE_EDGE // 8, MEASURE_EDGE // 8)
+    )
+    return len(faces) > 0
+
+
+def check_quality(img, original_size):
+    """
+    Reject photos the AI backend could only answer with face=0, before a
+    credit or a remote call is spent on them: too small, blurred (variance
+    of the Laplacian), too dark or too bright, and, when OpenCV is
+    installed and AI_QUALITY_FACE_CHECK is on, without a detectable face.
+
+    `img` is the decoded RGB image; `original_size` its size before any
+    downscaling. Raises UnusableImage with the reason.
+    """
+    if min(original_size) < settings.AI_QUALITY_MIN_EDGE:
+        raise UnusableImage(
+            f"Photo is too small. Please upload at least {settings.AI_QUALITY_MIN_EDGE}px on the short side."
+        )
+
+    gray = img.convert("L")
+    gray = gray.reduce(max(1, max(gray.size) // MEASURE_EDGE))
+
+    brightness = ImageStat.Stat(gray).mean[0]
+    if brightness < settings.AI_QUALITY_MIN_BRIGHTNESS:
+        raise UnusableImage("Photo is too dark. Please retake it in better light.")
+    if brightness > settings.AI_QUALITY_MAX_BRIGHTNESS:
+        raise UnusableImage("Photo is overexposed. Please retake it in softer light.")
+
+    # Kernel filters leave the outermost pixels unfiltered
+    edges = gray.filter(LAPLACIAN).crop((1, 1, gray.width - 1, gray.height - 1))
+    sharpness = ImageStat.Stat(edges).var[0]
+    if sharpness < settings.AI_QUALITY_MIN_SHARPNESS:
+        raise UnusableImage("Photo is too blurry. Please hold still and retake it.")
+
+    if settings.AI_QUALITY_FACE_CHECK:
+        if cv2 is None:
+            logger.warning("AI_QUALITY_FACE_CHECK is on but OpenCV is not installed; skipping")
+        elif not _detect_face(gray):
+            raise UnusableImage("Invalid face. Please upload a real human face.")
+
+    logger.debug("Quality gate passed: brightness %.0f, sharpness %.0f", brightness, sharpness)
@@ -0,0 +1,183 @@
+import json
+import time
+import uuid
+import random
+import hashlib
+import logging
+from functools import wraps
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+LOCK_SECONDS = 10
+WAIT_SECONDS = 2
+POLL_INTERVAL = 0.05
+
+
+class ResponseCache:
+    """
+    Redis cache of per-user GET responses that only change when the user's
+    analyses do.
+
+    Entries are keyed by the user's version number, which invalidate()
+    bumps whenever an analysis is saved or deleted, so stale entries are
+    never read again and simply expire. The user's local date and time zone
+    are part of the key too, since "today" and "this month" move on their
+    own. On a miss only one request per key recomputes (under a short Redis
+    lock); the others wait up to WAIT_SECONDS for its result. TTLs are
+    jittered so entries written together do not expire together. Hits and
+    misses are counted per endpoint. If Redis is unreachable every request
+    is computed.
+    """
+
+    def __init__(self, name):
+        self.prefix = f"response-cache:{name}"
+
+    @property
+    def client(self):
+        return settings.REDIS_CLIENT
+
+    def _version_key(self, user_id):
+        return f"{self.prefix}:version:{user_id}"
+
+    def version(self, user_id):
+        """
+        The user's current version; changes whenever their analyses do.
+        None when the cache is off or Redis is unreachable.
+        """
+        if settings.AI_DASHBOARD_CACHE_SECONDS <= 0:
+            return None
+        try:
+            return int(self.client.get(self._version_key(user_id)) or 0)
+        except redis.RedisError:
+            logger.warning("Response cache: Redis unavailable", exc_info=True)
+            return None
+
+    def invalidate(self, user_id):
+        try:
+            self.client.incr(self._version_key(user_id))
+        except redis.RedisError:
+            logger.warning("Response cache: could not invalidate user %s", user_id, exc_info=True)
+
+    def entry_key(self, request, endpoint, version):
+        params = hashlib.sha1(request.query_params.urlencode().encode()).hexdigest()[:16]
+        return (
+            f"{self.prefix}:{request.user.id}:{version}:{endpoint}:"
+            f"{timezone.get_current_timezone_name()}:{timezone.localdate().isoformat()}:{params}"
+        )
+
+    def etag(self, request, endpoint, version):
+        """
+        ETag of the entry for this request at `version`, without reading it.
+        """
+        return quote_etag(hashlib.sha1(self.entry_key(request, endpoint, version).encode()).hexdigest())
+
+    def _count(self, endpoint, outcome):
+        try:
+            self.client.hincrby(f"{self.prefix}:stats", f"{endpoint}:{outcome}", 1)
+        except redis.RedisError:
+            pass
+
+    def _wait(self, key):
+        deadline = time.monotonic() + WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            cached, lock = self.client.mget(key, f"{key}:lock")
+            if cached is not None:
+                return cached
+            if lock is None:
+                break
+        return None
+
+    def get_or_compute(self, request, endpoint, compute, version):
+        """
+        The cached body for this request at `version` (see version()), or
+        compute() (JSON-serializable) stored for the next one.
+        """
+        if version is None:
+            return compute()
+        ttl = settings.AI_DASHBOARD_CACHE_SECONDS
+
+        key = self.entry_key(request, endpoint, version)
+        lock = f"{key}:lock"
+        token = uuid.uuid4().hex
+        try:
+            cached = self.client.get(key)
+            if cached is None and not self.client.set(lock, token, nx=True, ex=LOCK_SECONDS):
+                # Someone is already computing this entry
+                cached = self._wait(key)
+        except redis.RedisError:
+            logger.warning("Response cache: Redis unavailable", exc_info=True)
+            return compute()
+
+        if cached is not None:
+            self._count(endpoint, "hits")
+            return json.loads(cached)
+
+        self._count(endpoint, "misses")
+        try:
+            data = compute()
+            self.client.set(key, json.dumps(data), ex=ttl + random.randint(0, max(1, ttl // 10)))
+        except redis.RedisError:
+            logger.warning("Response cache: Redis unavailable", exc_info=True)
+        finally:
+            try:
+                if self.client.get(lock) == token:
+                    self.client.delete(lock)
+            except redis.RedisError:
+                pass
+        return data
+
+    def stats(self):
+        try:
+            counts = self.client.hgetall(f"{self.prefix}:stats")
+        except redis.RedisError:
+            return {}
+        stats = {}
+        for field, value in counts.items():
+            endpoint, outcome = field.rsplit(":", 1)
+            stats.setdefault(endpoint, {"hits": 0, "misses": 0})[outcome] = int(value)
+        for counts in stats.values():
+            total = counts["hits"] + counts["misses"]
+            counts["hit_rate"] = round(counts["hits"] / total, 3) if total else None
+        return stats
+
+
+dashboard_cache = ResponseCache("dashboard")
+
+
+def cached_per_user(endpoint, etag=None):
+    """
+    Serve a per-user APIView GET handler from dashboard_cache. The handler
+    must depend only on the user's analyses, the query string and the date.
+
+    The ETag is derived from the cache entry's key, i.e. the same version
+    the body is read at, so If-None-Match is answered 304 before the body
+    is read or computed. When the cache is off or Redis is unreachable,
+    `etag(request)` (if given) supplies it instead.
+    """
+    def decorator(get):
+        @wraps(get)
+        def wrapper(self, request, *args, **kwargs):
+            version = dashboard_cache.version(request.user.id)
+            if version is not None:
+                tag = dashboard_cache.etag(request, endpoint, version)
+            else:
+                tag = quote_etag(etag(request)) if etag else None
+
+            response = get_conditional_response(request, etag=tag) if tag else None
+            if response is None:
+                response = Response(dashboard_cache.get_or_compute(
+                    request, endpoint, lambda: get(self, request, *args, **kwargs).data, version
+                ))
+            if tag:
+                response.headers["ETag"] = tag
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,84 @@
+import time
+import hashlib
+import logging
+
+import redis
+from django.conf import settings
+
+from .models import ImageAnalysisResult
+
+logger = logging.getLogger(__name__)
+
+
+def image_digest(image):
+    """
+    SHA-256 of the uploaded file, leaving it rewound for the next reader.
+    """
+    digest = hashlib.sha256()
+    for chunk in image.chunks():
+        digest.update(chunk)
+    image.seek(0)
+    return digest.hexdigest()
+
+
+def _keys(user):
+    # hash: digest -> result id, zset: digest -> time it was stored
+    base = f"ai:result-cache:{user.id}"
+    return base, f"{base}:stored-at"
+
+
+def lookup(user, digest):
+    """
+    Return the user's stored analysis for this exact image, or None.
+    """
+    results_key, stored_at_key = _keys(user)
+    try:
+        pipe = settings.REDIS_CLIENT.pipeline()
+        pipe.hget(results_key, digest)
+        pipe.zscore(stored_at_key, digest)
+        result_id, stored_at = pipe.execute()
+    except redis.RedisError:
+        logger.warning("Result cache lookup failed", exc_info=True)
+        return None
+
+    if result_id is None or stored_at is None:
+        return None
+    if time.time() - stored_at > settings.AI_RESULT_CACHE_TTL:
+        return None
+
+    # The row may have been deleted since; treat that as a miss
+    return (
+        ImageAnalysisResult.objects
+        .select_related("ratings", "user")
+        .filter(id=result_id, user=user)
+        .first()
+    )
+
+
+def store(user, digest, result_id):
+    """
+    Remember `result_id` for this image, evicting expired entries and the
+    oldest ones beyond AI_RESULT_CACHE_MAX_ENTRIES.
+    """
+    results_key, stored_at_key = _keys(user)
+    now = time.time()
+    ttl = settings.AI_RESULT_CACHE_TTL
+    client = settings.REDIS_CLIENT
+    try:
+        pipe = client.pipeline()
+        pipe.hset(results_key, digest, result_id)
+        pipe.zadd(stored_at_key, {digest: now})
+        pipe.zrangebyscore(stored_at_key, "-inf", now - ttl)
+        pipe.zrange(stored_at_key, 0, -(settings.AI_RESULT_CACHE_MAX_ENTRIES + 1))
+        _, _, expired, overflow = pipe.execute()
+
+        evicted = set(expired) | set(overflow)
+        pipe = client.pipeline()
+        if evicted:
+            pipe.hdel(results_key, *evicted)
+            pipe.zrem(stored_at_key, *evicted)
+        pipe.expire(results_key, ttl)
+        pipe.expire(stored_at_key, ttl)
+        pipe.execute()
+    except redis.RedisError:
+        logger.warning("Result cache store failed", exc_info=True)
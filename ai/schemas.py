@@ -0,0 +1,29 @@
+from typing import Any, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class AIRatings(BaseModel):
+    model_config = ConfigDict(extra="ignore", allow_inf_nan=False)
+
+    skin_quality: float
+    jawline_definition: float
+    cheekbone_structure: float
+    eye_area: float
+    facial_proportions: float
+    symmetry: float = 0.0
+    goals: float = 0.0
+
+
+class AIAnalysis(BaseModel):
+    """
+    Body of a 200 answer from the AI backend. `ratings` is absent when no
+    face was found (face == 0).
+    """
+    model_config = ConfigDict(extra="ignore")
+
+    face: int = Field(ge=0)
+    ratings: Optional[AIRatings] = None
+    key_strengths: list[Any] = []
+    exercise_guidance: list[Any] = []
+    ai_recommendations: list[Any] = []
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import ImageAnalysisResult, Ratings
+from .models import AnalysisJob, ImageAnalysisResult, Ratings
 from django.contrib.auth import get_user_model
 
 
@@ -36,20 +36,23 @@ class ImageAnalysisResultSerializer(serializers.ModelSerializer):
     
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        # Ensure all rating fields are numeric before calculation
-        ratings = [
-            float(instance.ratings.skin_quality or 0),
-            float(instance.ratings.jawline_definition or 0),
-            float(instance.ratings.cheekbone_structure or 0),
-            float(instance.ratings.eye_area or 0),
-            float(instance.ratings.facial_proportions or 0)
-        ]
-        avg = sum(ratings) / 5
+        avg = instance.average_rating
+        if avg is None:
+            # Saved before the column existed and not backfilled yet
+            avg = instance.ratings.average()
         representation['average_rating'] = round(avg, 2)  # Keep as float, not string
         representation['user'] = instance.user.full_name if instance.user else None
         return representation
 
 
+class AnalysisJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.UUIDField(source="id", read_only=True)
+    data = ImageAnalysisResultSerializer(source="result", read_only=True)
+
+    class Meta:
+        model = AnalysisJob
+        fields = ["job_id", "status", "error", "data", "created_at", "updated_at"]
+
 
 class UserManagementSerializer(serializers.ModelSerializer):
     image_analysis = ImageAnalysisResultSerializer(many=True, read_only=True, source='imageanalysisresult_set')
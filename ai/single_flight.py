@@ -0,0 +1,132 @@
+import json
+import math
+import time
+import uuid
+import asyncio
+import logging
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 0.5
+
+
+class SingleFlight:
+    """
+    Coalesce identical work that arrives at the same time on different
+    workers, e.g. a double-tapped scan.
+
+    The first caller for a key takes a Redis lock with lead() and becomes
+    the leader; everyone else calls wait() and receives the outcome the
+    leader publish()es instead of doing the work again. If the leader
+    release()s without publishing (it failed) or takes longer than
+    AI_COALESCE_WAIT_SECONDS, wait() returns None and the follower goes
+    ahead on its own. If Redis is unreachable every caller leads.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.prefix = f"single-flight:{name}"
+
+    @property
+    def client(self):
+        return settings.REDIS_CLIENT
+
+    def _key(self, key, suffix):
+        return f"{self.prefix}:{key}:{suffix}"
+
+    def _count(self, outcome):
+        try:
+            self.client.hincrby(f"{self.prefix}:stats", outcome, 1)
+        except redis.RedisError:
+            pass
+
+    def lead(self, key):
+        """
+        Try to become the leader for `key`. Returns a token to pass to
+        publish()/release(), or None when another caller already leads.
+        """
+        token = uuid.uuid4().hex
+        ttl = math.ceil(settings.AI_CONNECT_TIMEOUT + settings.AI_READ_TIMEOUT) + 5
+        try:
+            if not self.client.set(self._key(key, "lock"), token, nx=True, ex=ttl):
+                return None
+            # Followers of this flight must not pick up the previous one's outcome
+            self.client.delete(self._key(key, "outcome"))
+        except redis.RedisError:
+            logger.warning("Single flight %s: Redis unavailable", self.name, exc_info=True)
+            return token
+        self._count("led")
+        return token
+
+    def publish(self, key, token, outcome):
+        """
+        Hand `outcome` (JSON-serializable) to the followers and drop the lock.
+        """
+        try:
+            self.client.set(self._key(key, "outcome"), json.dumps(outcome), ex=settings.AI_COALESCE_WAIT_SECONDS)
+        except redis.RedisError:
+            logger.warning("Single flight %s: Redis unavailable", self.name, exc_info=True)
+        self.release(key, token)
+
+    def release(self, key, token):
+        lock = self._key(key, "lock")
+        try:
+            if self.client.get(lock) == token:
+                self.client.delete(lock)
+        except redis.RedisError:
+            logger.warning("Single flight %s: Redis unavailable", self.name, exc_info=True)
+
+    def poll(self, key):
+        """
+        Returns (finished, outcome): the published outcome, or
+        (True, None) once the leader is gone without publishing.
+        """
+        try:
+            outcome, lock = self.client.mget(self._key(key, "outcome"), self._key(key, "lock"))
+        except redis.RedisError:
+            return True, None
+        if outcome is not None:
+            return True, json.loads(outcome)
+        return lock is None, None
+
+    def _finished(self, outcome):
+        self._count("coalesced" if outcome is not None else "fallback")
+        return outcome
+
+    def wait(self, key):
+        deadline = time.monotonic() + settings.AI_COALESCE_WAIT_SECONDS
+        interval = POLL_INTERVAL
+        while time.monotonic() < deadline:
+            finished, outcome = self.poll(key)
+            if finished:
+                return self._finished(outcome)
+            time.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+        self._count("timeout")
+        return None
+
+    async def wait_async(self, key):
+        deadline = time.monotonic() + settings.AI_COALESCE_WAIT_SECONDS
+        interval = POLL_INTERVAL
+        while time.monotonic() < deadline:
+            finished, outcome = await sync_to_async(self.poll, thread_sensitive=False)(key)
+            if finished:
+                return await sync_to_async(self._finished, thread_sensitive=False)(outcome)
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+        await sync_to_async(self._count, thread_sensitive=False)("timeout")
+        return None
+
+    def stats(self):
+        try:
+            return {key: int(value) for key, value in self.client.hgetall(f"{self.prefix}:stats").items()}
+        except redis.RedisError:
+            return {}
+
+
+scan_flights = SingleFlight("ai-scan")
@@ -0,0 +1,144 @@
+import json
+import math
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+RATING_FIELDS = (
+    "skin_quality",
+    "jawline_definition",
+    "cheekbone_structure",
+    "eye_area",
+    "facial_proportions",
+    "symmetry",
+    "goals",
+)
+
+
+class StubAIConfig:
+    """
+    Behaviour of the fake AI backend.
+
+    latency_dist is one of "fixed", "uniform", "exponential" or "lognormal";
+    latency_ms is the mean and spread_ms the half-width (uniform) or standard
+    deviation (lognormal) of the delay added to every analysis.
+    """
+
+    def __init__(self, latency_ms=300, latency_dist="lognormal", spread_ms=100,
+                 error_rate=0.0, error_status=503, no_face_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.spread_ms = spread_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.no_face_rate = no_face_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_options(cls, options):
+        return cls(
+            latency_ms=options["latency_ms"],
+            latency_dist=options["latency_dist"],
+            spread_ms=options["spread_ms"],
+            error_rate=options["error_rate"],
+            error_status=options["error_status"],
+            no_face_rate=options["no_face_rate"],
+            seed=options["seed"],
+        )
+
+    def latency(self):
+        mean = self.latency_ms / 1000
+        spread = self.spread_ms / 1000
+        with self.lock:
+            if mean <= 0 or self.latency_dist == "fixed":
+                return max(mean, 0)
+            if self.latency_dist == "uniform":
+                return max(0, self.random.uniform(mean - spread, mean + spread))
+            if self.latency_dist == "exponential":
+                return self.random.expovariate(1 / mean)
+            sigma2 = math.log(1 + (spread / mean) ** 2)
+            return self.random.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def analysis(self):
+        if self.roll(self.no_face_rate):
+            return {"face": 0}
+        with self.lock:
+            ratings = {field: round(self.random.uniform(4, 9.5), 1) for field in RATING_FIELDS}
+        return {
+            "face": 1,
+            "ratings": ratings,
+            "key_strengths": ["Balanced facial proportions"],
+            "exercise_guidance": ["Jaw exercises, 10 minutes daily"],
+            "ai_recommendations": ["Stay hydrated", "Use sunscreen"],
+        }
+
+
+def add_stub_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=300, help="Mean analysis latency.")
+    parser.add_argument(
+        "--latency-dist", choices=("fixed", "uniform", "exponential", "lognormal"), default="lognormal"
+    )
+    parser.add_argument("--spread-ms", type=float, default=100, help="Latency spread (uniform/lognormal).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls that fail.")
+    parser.add_argument("--error-status", type=int, default=503, help="Status returned by failed calls.")
+    parser.add_argument("--no-face-rate", type=float, default=0.0, help="Fraction of calls answering face=0.")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+class StubAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(200, {"status": "ok"})
+
+    def do_POST(self):
+        config = self.server.config
+        remaining = int(self.headers.get("Content-Length") or 0)
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 64 * 1024)))
+
+        time.sleep(config.latency())
+        if config.roll(config.error_rate):
+            self._reply(config.error_status, {"detail": "stub failure"})
+            return
+        self._reply(200, config.analysis())
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubAIServer(ThreadingHTTPServer):
+    """
+    Local stand-in for BASE_URL_AI: answers every POST with a random
+    analysis after a configurable delay, and every GET as a health check.
+    """
+    daemon_threads = True
+
+    def __init__(self, config, host="127.0.0.1", port=0):
+        super().__init__((host, port), StubAIHandler)
+        self.config = config
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/analyze-face"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,94 @@
+import os
+import random
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+
+from .ai_client import AIServiceUnavailable, analyze_image
+from .circuit_breaker import CircuitOpen
+from .endpoint_pool import ai_endpoints
+from .models import AnalysisJob
+from .pipeline import AnalysisFailed, read_ai_response, save_analysis
+from .preprocessing import InvalidImage, normalize_image
+from .quality_gate import UnusableImage
+from payment.models import CreditHold
+
+logger = logging.getLogger(__name__)
+
+
+def _finish(job, status, error=""):
+    job.status = status
+    job.error = error
+    job.save(update_fields=["status", "error", "result", "updated_at"])
+    if job.image:
+        transaction.on_commit(lambda: job.image.delete(save=False))
+
+
+@shared_task(ignore_result=True)
+def check_ai_endpoints():
+    """
+    Active health check of every AI endpoint, scheduled by celery beat.
+    """
+    ai_endpoints.check_health()
+
+
+@shared_task(bind=True, acks_late=True, ignore_result=True, max_retries=settings.AI_JOB_MAX_RETRIES)
+def run_analysis_job(self, job_id):
+    """
+    Run one queued analysis: call the AI backend, then store the result and
+    charge the credit. Transient AI failures are retried with backoff. A
+    credit is held during each attempt and only charged when a result is
+    saved.
+    """
+    job = AnalysisJob.objects.select_related("user").filter(id=job_id).first()
+    if job is None or job.status in ("succeeded", "failed"):
+        return
+
+    job.status = "running"
+    job.attempts += 1
+    job.save(update_fields=["status", "attempts", "updated_at"])
+
+    hold = CreditHold.place(job.user)
+    if hold is None:
+        _finish(job, "failed", "Not enough credits.")
+        return
+
+    try:
+        with job.image.open("rb") as image:
+            try:
+                upload = normalize_image(os.path.basename(job.image.name), image, job.content_type)
+            except (InvalidImage, UnusableImage) as exc:
+                _finish(job, "failed", str(exc.detail))
+                return
+
+            try:
+                ai_response = analyze_image(*upload)
+                retryable = ai_response.status_code >= 500
+            except (AIServiceUnavailable, CircuitOpen):
+                ai_response = None
+                retryable = True
+
+        if retryable:
+            if self.request.retries >= self.max_retries:
+                logger.warning("Analysis job %s gave up after %s attempts", job.id, job.attempts)
+                _finish(job, "failed", "AI service is temporarily unavailable.")
+                return
+            job.status = "pending"
+            job.save(update_fields=["status", "updated_at"])
+            countdown = settings.AI_JOB_RETRY_BACKOFF * (2 ** self.request.retries)
+            raise self.retry(countdown=countdown + random.uniform(0, settings.AI_JOB_RETRY_BACKOFF))
+
+        try:
+            data = read_ai_response(ai_response)
+        except AnalysisFailed as exc:
+            _finish(job, "failed", exc.message)
+            return
+
+        with transaction.atomic():
+            job.result = save_analysis(job.user, data, digest=job.digest, hold=hold)
+            _finish(job, "succeeded")
+    finally:
+        # Held only for this attempt; a retry places a new hold
+        hold.release()
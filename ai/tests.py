@@ -1,3 +1,220 @@
-from django.test import TestCase
+from datetime import datetime, time, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .local_time import day_start
+from .models import AnalysisStats, ImageAnalysisResult, Ratings
+from .response_cache import dashboard_cache
+
+
+# Measures the view itself, not the dashboard response cache
+@override_settings(AI_DASHBOARD_CACHE_SECONDS=0)
+class ProgressViewTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "progress@example.com", "Progress User", "0100000000", "pw", is_active=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse("analysis-progress-data")
+
+    def add_analysis(self, when, score, goals):
+        with mock.patch("django.utils.timezone.now", return_value=when):
+            ratings = Ratings.objects.create(
+                skin_quality=score, jawline_definition=score, cheekbone_structure=score,
+                eye_area=score, facial_proportions=score, symmetry=score, goals=goals,
+            )
+            return ImageAnalysisResult.objects.create(user=self.user, face=1, ratings=ratings)
+
+    def add_history(self):
+        last_month = timezone.localdate().replace(day=1) - timedelta(days=1)
+        last_month_noon = timezone.make_aware(datetime.combine(last_month, time(12)))
+        self.add_analysis(last_month_noon - timedelta(days=1), 6, goals=4)
+        self.add_analysis(last_month_noon, 7, goals=6)
+        self.add_analysis(timezone.now(), 8.5, goals=8)
+
+    def test_progress_numbers(self):
+        self.add_history()
+
+        data = self.client.get(self.url).json()
+
+        self.assertEqual(data["improvement_ratings"], 2.0)
+        self.assertEqual(data["goal_score"], 6.0)
+        self.assertEqual(data["this_month_improvement_goals"], 3.0)
+        self.assertEqual(data["today_scans"], 1)
+
+    def test_rebuilt_stats_match_incremental_stats(self):
+        self.add_history()
+        incremental = self.client.get(self.url).json()
+
+        AnalysisStats.objects.all().delete()
+
+        self.assertEqual(self.client.get(self.url).json(), incremental)
+
+    def test_stats_build_before_average_rating_backfill(self):
+        self.add_history()
+        backfilled = self.client.get(self.url).json()
+
+        # Rows saved before the average_rating column existed
+        ImageAnalysisResult.objects.update(average_rating=None)
+        AnalysisStats.objects.all().delete()
+
+        self.assertEqual(self.client.get(self.url).json(), backfilled)
+        self.assertEqual(AnalysisStats.objects.get(user=self.user).score_buckets, {"6.0": 1, "7.0": 1, "8.5": 1})
+
+        # The next scan is added to that row incrementally
+        with mock.patch.object(AnalysisStats, "build") as build:
+            latest = self.add_analysis(timezone.now(), 9, goals=9)
+        build.assert_not_called()
+        stats = AnalysisStats.objects.get(user=self.user)
+        self.assertEqual(stats.scans, 4)
+        self.assertEqual(stats.score_buckets, {"6.0": 1, "7.0": 1, "8.5": 1, "9.0": 1})
+        self.assertEqual((stats.latest_id, stats.latest_average), (latest.pk, 9))
+        self.assertEqual((stats.previous_average, stats.earlier_average_sum), (8.5, 21.5))
+
+    def test_stats_follow_queryset_and_cascade_deletes(self):
+        self.add_history()
+        latest = ImageAnalysisResult.objects.latest("created_at")
+
+        # Ratings cascades to its analysis
+        latest.ratings.delete()
+        stats = AnalysisStats.objects.get(user=self.user)
+        self.assertEqual(stats.scans, 2)
+        self.assertEqual(stats.latest_average, 7)
+
+        ImageAnalysisResult.objects.filter(user=self.user).delete()
+        stats = AnalysisStats.objects.get(user=self.user)
+        self.assertEqual((stats.scans, stats.latest, stats.metric_sums, stats.months), (0, None, {}, {}))
+
+    def test_queryset_deletes_invalidate_cached_responses(self):
+        self.add_history()
+
+        with mock.patch.object(dashboard_cache, "invalidate") as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                ImageAnalysisResult.objects.filter(user=self.user).delete()
+
+        invalidate.assert_called_once_with(self.user.id)
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.add_history()
+        # One read of the user's stats row
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+        # Rebuilding a missing row: latest two results, totals, months and
+        # score buckets, then the write
+        AnalysisStats.objects.all().delete()
+        with self.assertNumQueries(9):
+            self.client.get(self.url)
+
+        for _ in range(20):
+            self.add_analysis(timezone.now(), 7.5, goals=7)
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+        AnalysisStats.objects.all().delete()
+        with self.assertNumQueries(9):
+            self.client.get(self.url)
+
+
+@override_settings(AI_DASHBOARD_CACHE_SECONDS=0)
+class ETagTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "etag@example.com", "ETag User", "0100000000", "pw", is_active=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        ratings = Ratings.objects.create(
+            skin_quality=7, jawline_definition=7, cheekbone_structure=7, eye_area=7, facial_proportions=7,
+        )
+        ImageAnalysisResult.objects.create(user=self.user, face=1, ratings=ratings)
+
+    def revalidate(self, url):
+        etag = self.client.get(url)["ETag"]
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_analysis_list_changes_with_the_users_name(self):
+        url = reverse("analysis-results-list")
+        self.assertEqual(self.revalidate(url).status_code, 304)
+
+        etag = self.client.get(url)["ETag"]
+        self.user.full_name = "Renamed User"
+        self.user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["user"], "Renamed User")
+
+    def test_dashboard_etag_without_the_response_cache(self):
+        url = reverse("analysis-progress-data")
+        self.assertEqual(self.revalidate(url).status_code, 304)
+
+    def test_dashboard_etag_follows_the_cache_version(self):
+        url = reverse("analysis-progress-data")
+        with mock.patch.object(dashboard_cache, "version", return_value=1), \
+                mock.patch.object(dashboard_cache, "get_or_compute", return_value={"cached": True}) as get:
+            etag = self.client.get(url)["ETag"]
+            get.reset_mock()
+
+            # Answered from the version alone: the body is not read
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            get.assert_not_called()
+
+        with mock.patch.object(dashboard_cache, "version", return_value=2), \
+                mock.patch.object(dashboard_cache, "get_or_compute", return_value={"cached": True}):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Per-user time and score lookups are answered from the composite
+    indexes alone, however many analyses there are.
+    """
+
+    def setUp(self):
+        self.users = [
+            get_user_model().objects.create_user(f"plan{i}@example.com", "Plan User", "0100000000", "pw")
+            for i in range(3)
+        ]
+
+    def add_analyses(self, count):
+        for i in range(count):
+            score = 4 + i % 5
+            ratings = Ratings.objects.create(
+                skin_quality=score, jawline_definition=score, cheekbone_structure=score,
+                eye_area=score, facial_proportions=score,
+            )
+            ImageAnalysisResult.objects.create(user=self.users[i % 3], face=1, ratings=ratings)
+
+    def assertIndexOnly(self, queryset, index):
+        self.assertIn(f"USING COVERING INDEX {index}", queryset.explain())
+
+    @skipUnless(connection.vendor == "sqlite", "checks SQLite's EXPLAIN QUERY PLAN output")
+    def test_lookups_stay_index_only(self):
+        today = timezone.localdate()
+        user = self.users[0]
+        for count in (30, 300):
+            self.add_analyses(count)
+
+            # A local day as a created_at range, as the analytics views filter it
+            self.assertIndexOnly(
+                ImageAnalysisResult.objects.filter(
+                    user=user,
+                    created_at__gte=day_start(today),
+                    created_at__lt=day_start(today + timedelta(days=1)),
+                ).values("pk"),
+                "analysis_user_created_idx",
+            )
+            self.assertIndexOnly(
+                ImageAnalysisResult.objects.filter(user=user, average_rating__gte=7)
+                .order_by("-average_rating").values("pk"),
+                "analysis_user_score_idx",
+            )
@@ -0,0 +1,142 @@
+import time
+import logging
+
+import redis
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from payment.models import PaypalEvent, Subscription
+
+logger = logging.getLogger(__name__)
+
+PLAN_CACHE_SECONDS = 300
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(rate):
+    """
+    (count, seconds) for a DRF-style rate such as "20/min"; (None, None)
+    when the rate is empty, i.e. unlimited.
+    """
+    if not rate:
+        return None, None
+    num, period = rate.split("/")
+    return int(num), PERIODS[period[0]]
+
+
+def user_plan(user):
+    """
+    Name of the user's most recently bought StripePlan or Plan, or "".
+    """
+    stripe = Subscription.objects.filter(user=user).order_by("-created_at").values_list("created_at", "plan__name").first()
+    paypal = PaypalEvent.objects.filter(user=user).order_by("-created_at").values_list("created_at", "plan__name").first()
+    latest = max([purchase for purchase in (stripe, paypal) if purchase], default=None)
+    return latest[1] if latest else ""
+
+
+class ScanRateThrottle(BaseThrottle):
+    """
+    Rate limit for the endpoints that call the AI backend, shared by every
+    worker and container through Redis.
+
+    Each user gets AI_SCAN_RATE_USER, or the rate AI_SCAN_RATE_PLANS gives
+    their latest purchased plan; AI_SCAN_RATE_GLOBAL caps all users
+    together to protect the AI backend. Windows are sliding (the previous
+    window's count is weighted by how much of it still overlaps). If Redis
+    is unreachable, requests are let through.
+
+    Every request counts as one scan; a view that makes several AI calls
+    per request charges the rest with consume() once it knows how many.
+    The user's limit is left on `request.rate_limit` for
+    add_rate_limit_headers().
+    """
+    prefix = "ratelimit:ai-scan"
+
+    def __init__(self):
+        self.retry_after = None
+
+    @property
+    def client(self):
+        return settings.REDIS_CLIENT
+
+    def user_rate(self, user):
+        if not settings.AI_SCAN_RATE_PLANS:
+            return settings.AI_SCAN_RATE_USER
+        key = f"{self.prefix}:plan:{user.id}"
+        plan = self.client.get(key)
+        if plan is None:
+            plan = user_plan(user)
+            self.client.set(key, plan, ex=PLAN_CACHE_SECONDS)
+        return settings.AI_SCAN_RATE_PLANS.get(plan, settings.AI_SCAN_RATE_USER)
+
+    def hit(self, key, duration, cost=1):
+        """
+        Count `cost` scans against `key`. Returns (scans in the sliding
+        window, seconds until the current window ends).
+        """
+        now = time.time()
+        window = int(now // duration)
+        elapsed = now - window * duration
+        current_key = f"{self.prefix}:{key}:{window}"
+
+        pipe = self.client.pipeline()
+        pipe.incrby(current_key, cost)
+        pipe.expire(current_key, duration * 2)
+        pipe.get(f"{self.prefix}:{key}:{window - 1}")
+        current, _, previous = pipe.execute()
+
+        count = int(previous or 0) * (duration - elapsed) / duration + current
+        return count, duration - elapsed
+
+    def allow_request(self, request, view):
+        return self.consume(request, 1)
+
+    def consume(self, request, cost):
+        """
+        Charge `cost` scans to the user's and the global limit. Returns
+        False, with wait() set, if either is now exceeded.
+        """
+        user = request.user
+        if cost <= 0 or not (user and user.is_authenticated):
+            return True
+
+        try:
+            limits = [(f"user:{user.id}", self.user_rate(user)), ("global", settings.AI_SCAN_RATE_GLOBAL)]
+            for key, rate in limits:
+                num_requests, duration = parse_rate(rate)
+                if num_requests is None:
+                    continue
+                count, reset = self.hit(key, duration, cost)
+                if key != "global":
+                    request.rate_limit = (num_requests, max(0, num_requests - int(count)), reset)
+                if count > num_requests:
+                    self.retry_after = reset
+                    return False
+        except redis.RedisError:
+            logger.warning("Scan rate limit: Redis unavailable", exc_info=True)
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+
+def add_rate_limit_headers(request, response):
+    rate_limit = getattr(request, "rate_limit", None)
+    if rate_limit is not None:
+        limit, remaining, reset = rate_limit
+        response["RateLimit-Limit"] = str(limit)
+        response["RateLimit-Remaining"] = str(remaining)
+        response["RateLimit-Reset"] = str(max(1, round(reset)))
+    return response
+
+
+class ScanRateLimitMixin:
+    """
+    Apply ScanRateThrottle to an APIView and report the caller's limit in
+    RateLimit-* headers on every response, including the 429.
+    """
+    throttle_classes = [ScanRateThrottle]
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        return add_rate_limit_headers(request, response)
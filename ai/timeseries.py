@@ -0,0 +1,91 @@
+import numpy
+
+from .models import RATING_METRICS
+
+# Series the metric-series endpoint can return: the overall score and each Ratings field
+SERIES = ("average_rating",) + RATING_METRICS
+METHODS = ("lttb", "mean")
+
+
+def lttb_indices(x, y, points):
+    """
+    Indices of the `points` samples of (x, y) picked by Largest-Triangle-
+    Three-Buckets: first and last sample, plus per bucket the one forming
+    the largest triangle with the previous pick and the next bucket's mean.
+    Keeps peaks and dips that a plain average would flatten. x must be
+    sorted; the loop runs per bucket, the work inside is vectorized.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return numpy.arange(n)
+
+    # points - 2 buckets over the samples between the first and last
+    edges = numpy.linspace(1, n - 1, points - 1).astype(int)
+    picked = numpy.empty(points, dtype=int)
+    picked[0], picked[-1] = 0, n - 1
+
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i == points - 3:
+            next_x, next_y = x[-1], y[-1]
+        else:
+            next_x, next_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        areas = numpy.abs(
+            (x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(numpy.argmax(areas))
+        picked[i + 1] = a
+    return picked
+
+
+def bucket_means(x, values, points):
+    """
+    Split the span of x into `points` equal time buckets and average x and
+    every column of `values` per bucket. Empty buckets are dropped.
+    """
+    edges = numpy.linspace(x[0], x[-1], points + 1)
+    bins = numpy.clip(numpy.searchsorted(edges, x, side="right") - 1, 0, points - 1)
+    counts = numpy.bincount(bins, minlength=points)
+    keep = counts > 0
+
+    sums = numpy.zeros((points, values.shape[1]))
+    numpy.add.at(sums, bins, values)
+    x_sums = numpy.bincount(bins, weights=x, minlength=points)
+    return x_sums[keep] / counts[keep], sums[keep] / counts[keep, None]
+
+
+def metric_series(analyses, metrics=SERIES, points=200, method="lttb"):
+    """
+    Columnar time series of `metrics` over the `analyses` queryset, at most
+    `points` long: {"timestamps": [epoch ms], "series": {metric: [value]},
+    "total": analyses in range}. With "lttb" every metric is sampled at the
+    analyses LTTB picks from the overall score, so they share timestamps;
+    "mean" averages fixed time buckets.
+    """
+    fields = [name if name == "average_rating" else f"ratings__{name}" for name in metrics]
+    rows = analyses.order_by("created_at", "id").values_list("created_at", *fields)
+    # Scores saved before average_rating was backfilled come through as NaN
+    data = numpy.array(
+        [(created_at.timestamp(), *values) for created_at, *values in rows], dtype=float
+    ).reshape(-1, len(fields) + 1)
+    x, values = data[:, 0], data[:, 1:]
+    total = len(x)
+
+    if total > points:
+        if method == "mean":
+            x, values = bucket_means(x, values, points)
+        else:
+            score = values[:, metrics.index("average_rating")] if "average_rating" in metrics else values.mean(axis=1)
+            picked = lttb_indices(x, numpy.nan_to_num(score), points)
+            x, values = x[picked], values[picked]
+
+    values = numpy.round(values, 2)
+    return {
+        "total": total,
+        "timestamps": numpy.round(x * 1000).astype(numpy.int64).tolist(),
+        "series": {
+            name: [None if numpy.isnan(value) else value for value in column.tolist()]
+            for name, column in zip(metrics, values.T)
+        },
+    }
@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError, UnsupportedMediaType
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Image is too large."
+    default_code = "upload_too_large"
+
+
+# Leading bytes of the formats the AI backend accepts
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+)
+HEIF_BRANDS = {b"heic": "image/heic", b"heix": "image/heic", b"mif1": "image/heif", b"avif": "image/avif"}
+
+
+def sniff_image_type(head):
+    """
+    Return the image MIME type for the first bytes of a file, or None.
+    """
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        return HEIF_BRANDS.get(head[8:12])
+    return None
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Spool image uploads straight to disk so a scan never holds the whole
+    file in memory, rejecting oversized bodies before they are read and
+    non-images from their first chunk. AI_UPLOAD_MAX_BYTES applies to each
+    of up to `max_files` images.
+    """
+
+    def __init__(self, request=None, max_files=1):
+        super().__init__(request)
+        self.max_files = max_files
+        self.file_count = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > settings.AI_UPLOAD_MAX_BYTES * self.max_files:
+            raise UploadTooLarge()
+
+    def new_file(self, field_name, file_name, content_type, *args, **kwargs):
+        self.file_count += 1
+        if self.file_count > self.max_files:
+            raise ParseError(f"At most {self.max_files} images can be uploaded at once.")
+        if not (content_type.startswith("image/") or content_type == "application/octet-stream"):
+            raise UnsupportedMediaType(content_type)
+        super().new_file(field_name, file_name, content_type, *args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0:
+            sniffed = sniff_image_type(raw_data[:16])
+            if sniffed is None:
+                raise UnsupportedMediaType(self.content_type)
+            # Trust the bytes over the client-supplied header
+            self.file.content_type = sniffed
+
+        self.received += len(raw_data)
+        if self.received > settings.AI_UPLOAD_MAX_BYTES:
+            raise UploadTooLarge()
+        return super().receive_data_chunk(raw_data, start)
+
+
+class ImageUploadMixin:
+    """
+    Install ImageUploadHandler before DRF wraps and parses the request.
+    """
+    upload_max_files = 1
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [ImageUploadHandler(request, max_files=self.upload_max_files)]
+        return super().initialize_request(request, *args, **kwargs)
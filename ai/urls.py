@@ -4,11 +4,16 @@ from .views import *
 
 urlpatterns = [
     path('analyze-image/', ImageAnalysis.as_view(), name='analyze-image'),
+    path('analyze-image/async/', AsyncImageAnalysis.as_view(), name='analyze-image-async'),
+    path('analyze-image/batch/', BatchImageAnalysis.as_view(), name='analyze-image-batch'),
+    path('analyze-image/jobs/', AnalysisJobCreateView.as_view(), name='analyze-image-job-create'),
+    path('analyze-image/jobs/<uuid:job_id>/', AnalysisJobStatusView.as_view(), name='analyze-image-job-status'),
     path('analysis-list/', ImageAnalysisResultsListView.as_view(), name='analysis-results-list'),
     path('user-dashboard/', AnalysisResultsDashboardView.as_view(), name='analysis-results-user-dashboard'),
     path('progress-data/', ProgressView.as_view(), name='analysis-progress-data'),
     path('score-history/', ScoreHistoryView.as_view(), name='analysis-score-history'),
     path('detailed-metrics/', DetailedMetricsView.as_view(), name='analysis-detailed-metrics'),
+    path('metric-series/', MetricSeriesView.as_view(), name='analysis-metric-series'),
 
     # Admin URLs
     path('admin/user-overview/', UserOverviewView.as_view(), name='admin-user-overview'),
@@ -16,4 +21,7 @@ urlpatterns = [
     path('admin/payment-graph/', PaymentGraph.as_view(), name='admin-payment-graph'),
     path('admin/user-management/', UserManagementView.as_view(), name='admin-user-management'),
     path('admin/payment/', PaymentListView.as_view(), name='admin-payment-list'),
+    path('admin/ai-circuit/', AICircuitStatusView.as_view(), name='admin-ai-circuit'),
+    path('admin/ai-endpoints/', AIEndpointStatusView.as_view(), name='admin-ai-endpoints'),
+    path('admin/ai-metrics/', AIScanMetricsView.as_view(), name='admin-ai-metrics'),
 ]
\ No newline at end of file
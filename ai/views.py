@@ -1,31 +1,114 @@
 import datetime
-from statistics import mean
-from django.db import models
+import hashlib
+import math
 from datetime import timedelta
 from django.utils import timezone
-from django.shortcuts import render
-from rest_framework import generics
-from django.utils.timezone import now
+from django.utils.dateparse import parse_date
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from rest_framework import generics, permissions
 from django.db.models import Count, Sum
 from rest_framework.views import APIView
-from ai.models import ImageAnalysisResult
+from ai.local_time import UserTimezoneMixin, day_start
+from ai.models import SCORE_BUCKET_WIDTH, AnalysisStats, ImageAnalysisResult, score_buckets
+from ai.circuit_breaker import ai_breaker
+from ai.endpoint_pool import ai_endpoints
+from ai.metrics import scan_metrics
+from ai.response_cache import cached_per_user, dashboard_cache
+from ai.single_flight import scan_flights
+from ai.timeseries import METHODS, SERIES, metric_series
 from rest_framework.response import Response
 from .serializers import ImageAnalysisResultSerializer, UserManagementSerializer
 from django.contrib.auth import get_user_model
-from payment.models import  AnalysisCreditTransaction, PaypalEvent, Plan
+from payment.models import  AnalysisCreditTransaction, PaypalEvent
 from django.db.models.functions import TruncMonth
 
 
 User = get_user_model()
 
 
+def date_param(request, name):
+    """
+    The YYYY-MM-DD query parameter `name` as a date, or None if missing or invalid.
+    """
+    try:
+        return parse_date(request.query_params.get(name, ""))
+    except ValueError:
+        return None
+
+
+def float_param(request, name):
+    """
+    The query parameter `name` as a finite float, or None if missing or invalid.
+    """
+    try:
+        value = float(request.query_params[name])
+    except (KeyError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def user_stats(request):
+    """
+    The user's AnalysisStats, read once per request and left on
+    `request.analysis_stats` for the ETag check and the view.
+    """
+    stats = getattr(request, "analysis_stats", None)
+    if stats is None:
+        stats = request.analysis_stats = AnalysisStats.for_user(request.user)
+    return stats
+
+
+def analyses_etag(request, *args, **kwargs):
+    """
+    Strong ETag for a per-user analysis endpoint, computed without running
+    the view: the user's AnalysisStats row changes with every saved or
+    deleted analysis; the user's name (shown on every analysis-list row),
+    path, query string, local date and time zone cover the rest of what
+    the body depends on. The dashboard endpoints only use it when the
+    response cache is off, see cached_per_user.
+    """
+    stats = user_stats(request)
+    marker = (
+        request.user.id, request.user.full_name,
+        stats.scans, stats.latest_id, stats.updated_at.isoformat(),
+        request.path, request.META.get("QUERY_STRING", ""),
+        timezone.get_current_timezone_name(), timezone.localdate().isoformat(),
+    )
+    return hashlib.sha1(repr(marker).encode()).hexdigest()
+
+
+# If-None-Match with the current ETag is answered 304 before the view runs
+conditional_get = method_decorator(condition(etag_func=analyses_etag), name="get")
+
+
 # Create your views here.
 
+@conditional_get
 class ImageAnalysisResultsListView(generics.ListAPIView):
+    """
+    The user's analyses, newest first. `min_score`/`max_score` keep those
+    whose average rating is in range; `ordering=score` or `-score` sorts by
+    average rating instead. `limit` is a count or "all" (default 3).
+    """
     serializer_class = ImageAnalysisResultSerializer
+    orderings = {
+        "score": ("average_rating", "id"),
+        "-score": ("-average_rating", "-id"),
+    }
     
     def get_queryset(self):
-        queryset = ImageAnalysisResult.objects.filter(user=self.request.user).order_by("-id")
+        queryset = ImageAnalysisResult.objects.filter(user=self.request.user).select_related("ratings", "user")
+
+        min_score = float_param(self.request, "min_score")
+        if min_score is not None:
+            queryset = queryset.filter(average_rating__gte=min_score)
+        max_score = float_param(self.request, "max_score")
+        if max_score is not None:
+            queryset = queryset.filter(average_rating__lte=max_score)
+
+        ordering = self.orderings.get(self.request.query_params.get("ordering"), ("-id",))
+        queryset = queryset.order_by(*ordering)
         
         limit = self.request.query_params.get('limit', "3")
         
@@ -41,161 +124,115 @@ class ImageAnalysisResultsListView(generics.ListAPIView):
     
     
  
-class AnalysisResultsDashboardView(APIView):
+class AnalysisResultsDashboardView(UserTimezoneMixin, APIView):
+    @cached_per_user("dashboard", etag=analyses_etag)
     def get(self, request, *args, **kwargs):
-        user = request.user
-        today = now().date()
-        start_of_month = today.replace(day=1)
-        
-        # Analyses counts
-        analyses_this_month = ImageAnalysisResult.objects.filter(
-            user=user, created_at__date__gte=start_of_month
-        ).count()
+        stats = user_stats(request)
+        start_of_month = timezone.localdate().replace(day=1)
 
-        last_month_start = (start_of_month - timedelta(days=1)).replace(day=1)
-        analyses_last_month = ImageAnalysisResult.objects.filter(
-            user=user,
-            created_at__date__gte=last_month_start,
-            created_at__date__lt=start_of_month
-        ).count()
+        # Analyses counts
+        analyses_this_month = stats.month_scans(start_of_month)
+        analyses_last_month = stats.month_scans(start_of_month - timedelta(days=1))
 
         # Improvement in count
         count_diff = analyses_this_month - analyses_last_month
         improvement = f"+{count_diff}" if count_diff >= 0 else str(count_diff)
 
-        # Get latest two analyses
-        latest_analyses = ImageAnalysisResult.objects.filter(user=user).order_by('-created_at')[:2]
-        formatted = []
-
-        for analysis in latest_analyses:
-            serialized = ImageAnalysisResultSerializer(analysis).data
-            avg_rating = None
-            try:
-                avg_rating = float(serialized.get("average_rating"))
-            except (TypeError, ValueError):
-                pass
-            formatted.append({
-                "average_rating": avg_rating,
-                "ratings": serialized.get("ratings"),
-                "ai_recommendations": serialized.get("ai_recommendations")
-            })
-
-        latest = formatted[0] if len(formatted) > 0 else None
-        second_latest = formatted[1] if len(formatted) > 1 else None
+        latest = stats.latest
+        latest_score = round(stats.latest_average, 2) if latest else None
 
-        # Improvement in average score
+        # Improvement in average score over the previous analysis
         this_month_improvement_score = None
-        if latest and second_latest and latest["average_rating"] is not None and second_latest["average_rating"] is not None:
-            score_diff = round(latest["average_rating"] - second_latest["average_rating"], 2)
-            this_month_improvement_score = f"+{score_diff}" if score_diff >= 0 else str(score_diff)
-
-        # Symmetry improvement
         semmetric_improvement = None
-        if latest and second_latest:
-            try:
-                sym_diff = round(latest["ratings"]["symmetry"] - second_latest["ratings"]["symmetry"], 2)
+        if latest and stats.previous_average is not None:
+            score_diff = round(latest_score - round(stats.previous_average, 2), 2)
+            this_month_improvement_score = f"+{score_diff}" if score_diff >= 0 else str(score_diff)
+            if stats.previous_symmetry is not None:
+                sym_diff = round(latest.ratings.symmetry - stats.previous_symmetry, 2)
                 semmetric_improvement = f"+{sym_diff}" if sym_diff >= 0 else str(sym_diff)
-            except (TypeError, KeyError):
-                semmetric_improvement = None
 
         return Response({
             "total_scans": analyses_this_month,
             "this_month_improvement": improvement,
-            "latest_score": latest["average_rating"] if latest else None,
+            "latest_score": latest_score,
             "this_month_improvement_score": this_month_improvement_score,
-            "symmetry": latest["ratings"].get("symmetry") if latest else None,
+            "symmetry": latest.ratings.symmetry if latest else None,
             "semmetric_improvement": semmetric_improvement,
             # "user_balance": analysesBalance.objects.get_or_create(user=user)[0].balance,
-            "ai_recommendations": latest.get("ai_recommendations") if latest else None,
+            "ai_recommendations": latest.ai_recommendations if latest else None,
         })
         
         
         
-class ProgressView(APIView):
+class ProgressView(UserTimezoneMixin, APIView):
+    @cached_per_user("progress", etag=analyses_etag)
     def get(self, request, *args, **kwargs):
         user = request.user
-        analyses = ImageAnalysisResult.objects.filter(user=user).order_by('created_at')
-        rating = [analysis.ratings.skin_quality for analysis in analyses]
-        user_created_at = user.created_at
-        
-        # Get analyses for this month and last month
-        today = now().date()
-        start_of_month = today.replace(day=1)
-        last_month_start = (start_of_month - timedelta(days=1)).replace(day=1)
+        stats = user_stats(request)
+        user_created_at = timezone.localtime(user.created_at)
         
-        analyses_goals_this_month = [analysis.ratings.goals for analysis in analyses if analysis.created_at.date() >= start_of_month]
-        analyses_goals_last_month = [analysis.ratings.goals for analysis in analyses if last_month_start <= analysis.created_at.date() < start_of_month]
-        
-        # Calculate average goals for this month and last month
-        avg_goals_this_month = round(mean(analyses_goals_this_month), 2) if analyses_goals_this_month else 0
-        avg_goals_last_month = round(mean(analyses_goals_last_month), 2) if analyses_goals_last_month else 0
-        
-        avarage_rating_list = []
-        for analysis in analyses:
-            ratings = [
-                float(analysis.ratings.skin_quality or 0),
-                float(analysis.ratings.jawline_definition or 0),
-                float(analysis.ratings.cheekbone_structure or 0),
-                float(analysis.ratings.eye_area or 0),
-                float(analysis.ratings.facial_proportions or 0)
-            ]
-            avg_rating = sum(ratings) / 5
-            avarage_rating_list.append(avg_rating)
+        # Average goals for this month and last month
+        start_of_month = timezone.localdate().replace(day=1)
+        avg_goals_this_month = stats.month_goals(start_of_month)
+        avg_goals_last_month = stats.month_goals(start_of_month - timedelta(days=1))
         
         # Calculate improvement: last value minus average of all previous values
         improvement_from_last_two = 0
-        if len(avarage_rating_list) >= 2:
-            # Average of all values except the last one
-            avg_without_last = round(sum(avarage_rating_list[:-1]) / len(avarage_rating_list[:-1]), 2)
-            last = avarage_rating_list[-1]
-            improvement_from_last_two = round(last - avg_without_last, 2)
+        if stats.scans >= 2:
+            avg_without_last = round(stats.earlier_average_sum / (stats.scans - 1), 2)
+            improvement_from_last_two = round(stats.latest_average - avg_without_last, 2)
         
         data = {
             "improvement_ratings": improvement_from_last_two,
             "since_at": user_created_at.strftime("%d %B"),
-            "days_active": (now().date() - user_created_at.date()).days,
+            "days_active": (timezone.localdate() - user_created_at.date()).days,
             "since_at_active": user_created_at.strftime("%d %B"),
-            "goal_score": round(mean([analysis.ratings.goals for analysis in analyses]), 2) if analyses else 0,
+            "goal_score": stats.metric_average("goals"),
             "this_month_improvement_goals": round(avg_goals_this_month - avg_goals_last_month, 2),
-            "today_scans": len([analysis for analysis in analyses if analysis.created_at.date() == now().date()])
+            "today_scans": stats.today_scans()
         }
         
         return Response(data)
     
     
 
-class ScoreHistoryView(APIView):
+class ScoreHistoryView(UserTimezoneMixin, APIView):
+    """
+    Number of analyses per range of average rating, lowest first. `width`
+    sets the size of the ranges (default 0.5); `start` and `end`
+    (YYYY-MM-DD, inclusive) limit the analyses counted. The default
+    histogram is read from the user's AnalysisStats row, any other is one
+    GROUP BY query.
+    """
+
+    @cached_per_user("score-history", etag=analyses_etag)
     def get(self, request, *args, **kwargs):
         user = request.user
 
-        # Get all analyses for the user
-        analyses = ImageAnalysisResult.objects.filter(user=user).select_related('ratings')
-        
-        # Calculate average rating for each analysis and group into 0.5 ranges
-        rating_counts = {}
-        for analysis in analyses:
-            ratings = [
-                float(analysis.ratings.skin_quality or 0),
-                float(analysis.ratings.jawline_definition or 0),
-                float(analysis.ratings.cheekbone_structure or 0),
-                float(analysis.ratings.eye_area or 0),
-                float(analysis.ratings.facial_proportions or 0)
-            ]
-            avg_rating = sum(ratings) / 5
-            
-            # Group into 0.5 ranges (e.g., 6.0-6.5, 6.5-7.0)
-            # Floor to nearest 0.5
-            range_start = int(avg_rating * 2) / 2
-            range_end = range_start + 0.5
-            range_key = f"{range_start} to {range_end}"
-            
-            rating_counts[range_key] = rating_counts.get(range_key, 0) + 1
-        
-        # Sort by rating range and format output
+        try:
+            width = float(request.query_params.get("width", SCORE_BUCKET_WIDTH))
+        except ValueError:
+            width = SCORE_BUCKET_WIDTH
+        if not 0.1 <= width <= 10:
+            width = SCORE_BUCKET_WIDTH
+        start = date_param(request, "start")
+        end = date_param(request, "end")
+
+        if width == SCORE_BUCKET_WIDTH and start is None and end is None:
+            stats = user_stats(request)
+            buckets = sorted((float(range_start), count) for range_start, count in stats.score_buckets.items())
+        else:
+            analyses = ImageAnalysisResult.objects.filter(user=user)
+            if start is not None:
+                analyses = analyses.filter(created_at__gte=day_start(start))
+            if end is not None:
+                analyses = analyses.filter(created_at__lt=day_start(end + timedelta(days=1)))
+            buckets = score_buckets(analyses, width)
+
         data = {
             "score_history": [
-                {"rating": rating, "count": count}
-                for rating, count in sorted(rating_counts.items(), key=lambda x: float(x[0].split(' ')[0]))
+                {"rating": f"{range_start} to {round(range_start + width, 4)}", "count": count}
+                for range_start, count in buckets
             ]
         }
 
@@ -204,24 +241,15 @@ class ScoreHistoryView(APIView):
 
 
 
-class DetailedMetricsView(APIView):
+class DetailedMetricsView(UserTimezoneMixin, APIView):
+    @cached_per_user("detailed-metrics", etag=analyses_etag)
     def get(self, request, *args, **kwargs):
-        user = request.user
-        analyses = ImageAnalysisResult.objects.filter(user=user).order_by('created_at')
-
-        ratings_data = {
-            "skin_quality": [a.ratings.skin_quality for a in analyses],
-            "jawline_definition": [a.ratings.jawline_definition for a in analyses],
-            "cheekbone_structure": [a.ratings.cheekbone_structure for a in analyses],
-            "eye_area": [a.ratings.eye_area for a in analyses],
-            "facial_proportions": [a.ratings.facial_proportions for a in analyses],
-            "symmetry": [a.ratings.symmetry for a in analyses],
-        }
+        stats = user_stats(request)
 
         # average values
         average_data = {
-            key: round(mean(value), 2) if value else 0
-            for key, value in ratings_data.items()
+            key: stats.metric_average(key)
+            for key in ("skin_quality", "jawline_definition", "cheekbone_structure", "eye_area", "facial_proportions", "symmetry")
         }
 
         data = {
@@ -232,6 +260,41 @@ class DetailedMetricsView(APIView):
 
 
 
+class MetricSeriesView(UserTimezoneMixin, APIView):
+    """
+    The user's ratings over time as columnar arrays for charts:
+    `timestamps` (epoch milliseconds) and one array per metric in `series`.
+    `start`/`end` (YYYY-MM-DD, inclusive) limit the range; `metrics` is a
+    comma separated subset of SERIES. Longer histories are downsampled to
+    `points` (default 200, at most 1000) with `method` "lttb" (default,
+    keeps peaks) or "mean" (per time bucket).
+    """
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+
+        try:
+            points = int(params.get("points", 200))
+        except ValueError:
+            points = 200
+        points = min(max(points, 3), 1000)
+        method = params.get("method") if params.get("method") in METHODS else "lttb"
+        metrics = tuple(name for name in params.get("metrics", "").split(",") if name in SERIES) or SERIES
+
+        analyses = ImageAnalysisResult.objects.filter(user=request.user)
+        start = date_param(request, "start")
+        if start is not None:
+            analyses = analyses.filter(created_at__gte=day_start(start))
+        end = date_param(request, "end")
+        if end is not None:
+            analyses = analyses.filter(created_at__lt=day_start(end + timedelta(days=1)))
+
+        data = metric_series(analyses, metrics, points=points, method=method)
+        data["method"] = method
+        return Response(data)
+
+
+
 class UserOverviewView(APIView):
     def get(self, request, *args, **kwargs):
         total_analysis = ImageAnalysisResult.objects.count()
@@ -330,6 +393,42 @@ class PaymentGraph(APIView):
     
     
     
+class AICircuitStatusView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            "state": ai_breaker.state(),
+            "transitions": ai_breaker.transition_counts(),
+        })
+
+
+class AIEndpointStatusView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            "endpoints": ai_endpoints.status(),
+            "coalesced_scans": scan_flights.stats(),
+        })
+
+
+class AIScanMetricsView(APIView):
+    """
+    Latency histograms of the analyze-image phases, in milliseconds, image
+    bytes before and after normalization, and hit/miss counts of the
+    dashboard response cache.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            "phases": scan_metrics.summary(),
+            "image_bytes": scan_metrics.sizes(),
+            "dashboard_cache": dashboard_cache.stats(),
+        })
+
+
 class UserManagementView(generics.ListAPIView):
     serializer_class = UserManagementSerializer
     queryset = User.objects.all().order_by("-id")
@@ -1,4 +1,4 @@
-from .models import StripePlan, Subscription, AnalysisCreditTransaction
+from .models import StripePlan, Subscription, AnalysisCreditTransaction, CreditBalance
 from django.contrib import admin
 
 @admin.register(StripePlan)
@@ -18,4 +18,11 @@ class SubscriptionAdmin(admin.ModelAdmin):
 class AnalysisCreditTransactionAdmin(admin.ModelAdmin):
     list_display = ('user', 'credits', 'type', 'reason', 'created_at')
     search_fields = ('user__email', 'type', 'reason')
-    list_filter = ('type', 'created_at')
\ No newline at end of file
+    list_filter = ('type', 'created_at')
+
+
+@admin.register(CreditBalance)
+class CreditBalanceAdmin(admin.ModelAdmin):
+    list_display = ('user', 'balance', 'held', 'updated_at')
+    search_fields = ('user__email',)
+    readonly_fields = ('user', 'balance', 'held', 'updated_at')
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from payment.models import SIGNED_CREDITS, AnalysisCreditTransaction, CreditBalance, CreditHold
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every user's credit balance from the AnalysisCreditTransaction "
+        "ledger, and held credits from the open CreditHolds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Only report balances that disagree with the ledger; exit non-zero if any do.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # Lock the balance rows before reading the ledger and holds: a
+            # transaction that writes either also updates its balance row, so
+            # it either committed before the lock or waits until we are done
+            stored = {
+                user_id: (balance, held)
+                for user_id, balance, held in
+                CreditBalance.objects.select_for_update().order_by("user_id").values_list("user_id", "balance", "held")
+            }
+            ledger = dict(
+                AnalysisCreditTransaction.objects.values_list("user_id").annotate(total=SIGNED_CREDITS)
+            )
+            holds = dict(CreditHold.objects.values_list("user_id").annotate(total=Sum("credits")))
+
+            expected = {
+                user_id: (ledger.get(user_id, 0), holds.get(user_id, 0))
+                for user_id in set(ledger) | set(holds) | set(stored)
+            }
+            wrong = {
+                user_id: values
+                for user_id, values in expected.items()
+                if user_id in stored and stored[user_id] != values
+            }
+            missing = [user_id for user_id in expected if user_id not in stored]
+
+            for user_id, (balance, held) in sorted(wrong.items()):
+                self.stdout.write(
+                    f"User {user_id}: balance {stored[user_id][0]} held {stored[user_id][1]}, "
+                    f"ledger {balance} holds {held}"
+                )
+
+            if options["check"]:
+                if wrong:
+                    raise CommandError(f"{len(wrong)} balance(s) disagree with the ledger.")
+                self.stdout.write(self.style.SUCCESS(f"{len(stored)} balance(s) match the ledger."))
+                return
+
+            for user_id, (balance, held) in wrong.items():
+                CreditBalance.objects.filter(user_id=user_id).update(balance=balance, held=held)
+            # A row created meanwhile by CreditBalance.initialize() is built from the ledger too
+            CreditBalance.objects.bulk_create([
+                CreditBalance(user_id=user_id, balance=expected[user_id][0], held=expected[user_id][1])
+                for user_id in missing
+            ], ignore_conflicts=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Fixed {len(wrong)} balance(s), created {len(missing)}."
+        ))
@@ -1,7 +1,10 @@
-from django.db import models #type: ignore
+import uuid
+from django.conf import settings
+from django.db import IntegrityError, models, transaction #type: ignore
 from django.contrib.auth import get_user_model #type: ignore
-from django.db.models import Sum
-from datetime import datetime
+from django.db.models import Case, F, Sum, When
+from django.utils import timezone
+from datetime import timedelta
 
 User = get_user_model()
 
@@ -80,20 +83,206 @@ class AnalysisCreditTransaction(models.Model):
     def __str__(self):
         return f"{self.user} - {self.type} - {self.credits}"
 
+    def signed_credits(self):
+        return {"purchase": 1, "use": -1}.get(self.type, 0) * self.credits
+
+    def save(self, *args, **kwargs):
+        # The balance row moves in the same transaction as the ledger
+        with transaction.atomic(savepoint=False):
+            delta = self.signed_credits()
+            if not self._state.adding:
+                previous = AnalysisCreditTransaction.objects.filter(pk=self.pk).first()
+                if previous is not None:
+                    delta -= previous.signed_credits()
+            super().save(*args, **kwargs)
+            if delta:
+                CreditBalance.apply(self.user_id, delta)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(savepoint=False):
+            delta = -self.signed_credits()
+            result = super().delete(*args, **kwargs)
+            if delta:
+                CreditBalance.apply(self.user_id, delta)
+        return result
+
     @staticmethod
     def get_balance(user):
-        purchase_total = (
-            AnalysisCreditTransaction.objects
-            .filter(user=user, type="purchase")
-            .aggregate(total=Sum("credits"))["total"]
-            or 0
+        return CreditBalance.get(user.pk)
+
+
+# purchase rows add credits, use rows spend them
+SIGNED_CREDITS = Sum(
+    Case(
+        When(type="purchase", then=F("credits")),
+        When(type="use", then=-F("credits")),
+        default=0,
+    ),
+    default=0,
+)
+
+
+class CreditBalance(models.Model):
+    """
+    Running total of a user's AnalysisCreditTransaction ledger, so checking
+    a balance is one primary key lookup instead of summing the whole
+    history. `held` counts the credits reserved by open CreditHolds; what
+    a user can spend is balance - held. Created from the ledger on first
+    use; `manage.py rebuild_credit_balances` recomputes every row.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="credit_balance")
+    balance = models.IntegerField(default=0)
+    held = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user} - {self.balance}"
+
+    @staticmethod
+    def ledger_total(user_id):
+        return AnalysisCreditTransaction.objects.filter(user_id=user_id).aggregate(total=SIGNED_CREDITS)["total"]
+
+    @classmethod
+    def get(cls, user_id):
+        """
+        Credits the user can spend right now.
+        """
+        available = (
+            cls.objects.filter(user_id=user_id)
+            .values_list(F("balance") - F("held"), flat=True)
+            .first()
         )
+        if available is None:
+            available = cls.initialize(user_id)
+        return available
+
+    @classmethod
+    def initialize(cls, user_id):
+        """
+        Create the user's balance row from the ledger and return it.
+        """
+        balance = cls.ledger_total(user_id)
+        try:
+            with transaction.atomic():
+                cls.objects.create(user_id=user_id, balance=balance)
+        except IntegrityError:
+            # Created concurrently; that row already reflects the ledger
+            return cls.objects.filter(user_id=user_id).values_list(F("balance") - F("held"), flat=True).get()
+        return balance
 
-        use_total = (
-            AnalysisCreditTransaction.objects
-            .filter(user=user, type="use")
-            .aggregate(total=Sum("credits"))["total"]
-            or 0
+    @classmethod
+    def apply(cls, user_id, delta):
+        """
+        Add `delta` to the balance. Called after the ledger row is written,
+        so a missing balance row is created from the ledger as it now is.
+        """
+        if cls.objects.filter(user_id=user_id).update(balance=F("balance") + delta):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(user_id=user_id, balance=cls.ledger_total(user_id))
+        except IntegrityError:
+            # Created concurrently from a ledger that did not include this row yet
+            cls.objects.filter(user_id=user_id).update(balance=F("balance") + delta)
+
+
+class CreditHold(models.Model):
+    """
+    A credit reserved for an analysis in progress.
+
+    place() reserves credits before the AI call with a single conditional
+    UPDATE of the user's CreditBalance row, so concurrent scans cannot spend
+    the same credit and scans of different users never touch the same row.
+    commit() turns the hold into a "use" ledger row once the result is
+    saved; release() gives it back when the analysis fails. Holds left
+    behind by a crashed worker expire after CREDIT_HOLD_SECONDS and are
+    released by the release_expired_credit_holds task.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="credit_holds")
+    credits = models.IntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    settled = False
+
+    def __str__(self):
+        return f"{self.user} - hold {self.credits}"
+
+    @staticmethod
+    def _reserve(user_id, credits):
+        return (
+            CreditBalance.objects
+            .filter(user_id=user_id, balance__gte=F("held") + credits)
+            .update(held=F("held") + credits)
         )
 
-        return purchase_total - use_total
\ No newline at end of file
+    @classmethod
+    def place(cls, user, credits=1):
+        """
+        Reserve `credits` for `user`. Returns the hold, or None when the
+        user does not have that many credits available.
+        """
+        with transaction.atomic():
+            reserved = cls._reserve(user.pk, credits)
+            if not reserved and not CreditBalance.objects.filter(user_id=user.pk).exists():
+                CreditBalance.initialize(user.pk)
+                reserved = cls._reserve(user.pk, credits)
+            if not reserved:
+                return None
+            return cls.objects.create(
+                user=user,
+                credits=credits,
+                expires_at=timezone.now() + timedelta(seconds=settings.CREDIT_HOLD_SECONDS),
+            )
+
+    def _settle(self, charge=False):
+        # Whoever deletes the row (commit, release or the sweeper) returns the
+        # reservation. Settled for good only once that commits: a rollback
+        # (e.g. of a batch whose later save failed) brings the row back, and
+        # release() must then still give it back.
+        transaction.on_commit(lambda: setattr(self, "settled", True))
+        if not CreditHold.objects.filter(pk=self.pk).delete()[0]:
+            return False
+        changes = {"held": F("held") - self.credits}
+        if charge:
+            changes["balance"] = F("balance") - self.credits
+        CreditBalance.objects.filter(user_id=self.user_id).update(**changes)
+        return True
+
+    def commit(self, reason="Used for image analysis."):
+        """
+        Charge the held credits. Returns the "use" ledger row.
+        """
+        with transaction.atomic(savepoint=False):
+            charged = self._settle(charge=True)
+            use = AnalysisCreditTransaction(
+                user_id=self.user_id,
+                credits=self.credits,
+                type="use",
+                reason=reason,
+            )
+            # bulk_create skips save(): the balance was already charged above
+            AnalysisCreditTransaction.objects.bulk_create([use])
+            if not charged:
+                # The hold expired and was swept meanwhile
+                CreditBalance.apply(self.user_id, use.signed_credits())
+            return use
+
+    def release(self):
+        """
+        Give the held credits back. A no-op once the hold is settled.
+        """
+        if self.settled:
+            return
+        with transaction.atomic(savepoint=False):
+            self._settle()
+
+    @classmethod
+    def release_expired(cls, limit=1000):
+        expired = cls.objects.filter(expires_at__lte=timezone.now()).order_by("expires_at")[:limit]
+        released = 0
+        for hold in expired:
+            hold.release()
+            released += 1
+        return released
@@ -0,0 +1,17 @@
+import logging
+
+from celery import shared_task
+
+from .models import CreditHold
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def release_expired_credit_holds():
+    """
+    Return credits held by analyses that never finished, scheduled by celery beat.
+    """
+    released = CreditHold.release_expired()
+    if released:
+        logger.warning("Released %s expired credit hold(s)", released)
@@ -0,0 +1,169 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from payment.models import AnalysisCreditTransaction, CreditBalance, CreditHold
+
+
+class CreditBalanceTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "credits@example.com", "Credit User", "0100000000", "pw", is_active=True
+        )
+
+    def stored_balance(self):
+        return CreditBalance.objects.get(user=self.user).balance
+
+    def assertMatchesLedger(self):
+        self.assertEqual(self.stored_balance(), CreditBalance.ledger_total(self.user.pk))
+
+    def test_ledger_writes_move_the_balance(self):
+        AnalysisCreditTransaction.objects.create(user=self.user, credits=5, type="purchase")
+        self.assertEqual(CreditBalance.get(self.user.pk), 5)
+
+        AnalysisCreditTransaction.objects.create(user=self.user, credits=1, type="use")
+        self.assertEqual(CreditBalance.get(self.user.pk), 4)
+        self.assertMatchesLedger()
+
+    def test_updating_a_ledger_row_applies_the_difference(self):
+        row = AnalysisCreditTransaction.objects.create(user=self.user, credits=5, type="purchase")
+
+        row.credits = 3
+        row.save()
+        self.assertEqual(self.stored_balance(), 3)
+
+        row.type = "use"
+        row.save()
+        self.assertEqual(self.stored_balance(), -3)
+        self.assertMatchesLedger()
+
+    def test_deleting_a_ledger_row_reverts_it(self):
+        AnalysisCreditTransaction.objects.create(user=self.user, credits=5, type="purchase")
+        use = AnalysisCreditTransaction.objects.create(user=self.user, credits=2, type="use")
+
+        use.delete()
+
+        self.assertEqual(self.stored_balance(), 5)
+        self.assertMatchesLedger()
+
+    def test_balance_row_is_created_from_an_existing_ledger(self):
+        # Rows written before CreditBalance existed (bulk_create skips save())
+        AnalysisCreditTransaction.objects.bulk_create([
+            AnalysisCreditTransaction(user=self.user, credits=10, type="purchase"),
+            AnalysisCreditTransaction(user=self.user, credits=3, type="use"),
+        ])
+        self.assertFalse(CreditBalance.objects.filter(user=self.user).exists())
+
+        self.assertEqual(CreditBalance.get(self.user.pk), 7)
+        self.assertEqual(self.stored_balance(), 7)
+
+        # Later writes move the created row
+        AnalysisCreditTransaction.objects.create(user=self.user, credits=1, type="use")
+        self.assertEqual(CreditBalance.get(self.user.pk), 6)
+
+    def test_rebuild_check_fails_on_drift(self):
+        AnalysisCreditTransaction.objects.create(user=self.user, credits=5, type="purchase")
+        call_command("rebuild_credit_balances", "--check", stdout=StringIO())
+
+        CreditBalance.objects.filter(user=self.user).update(balance=9)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_credit_balances", "--check", stdout=StringIO())
+        self.assertEqual(self.stored_balance(), 9)
+
+        call_command("rebuild_credit_balances", stdout=StringIO())
+        self.assertEqual(self.stored_balance(), 5)
+        call_command("rebuild_credit_balances", "--check", stdout=StringIO())
+
+
+class CreditHoldTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "holds@example.com", "Hold User", "0100000000", "pw", is_active=True
+        )
+        AnalysisCreditTransaction.objects.create(user=self.user, credits=2, type="purchase")
+
+    def balance(self):
+        row = CreditBalance.objects.get(user=self.user)
+        return row.balance, row.held
+
+    def uses(self):
+        return AnalysisCreditTransaction.objects.filter(user=self.user, type="use").count()
+
+    def expire(self, hold):
+        CreditHold.objects.filter(pk=hold.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_place_refuses_held_credits(self):
+        first = CreditHold.place(self.user)
+        second = CreditHold.place(self.user)
+
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertIsNone(CreditHold.place(self.user))
+        self.assertEqual(self.balance(), (2, 2))
+        self.assertEqual(CreditBalance.get(self.user.pk), 0)
+
+    def test_commit_charges_once(self):
+        hold = CreditHold.place(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            use = hold.commit()
+        with self.assertNumQueries(0):
+            hold.release()
+
+        self.assertEqual((use.type, use.credits), ("use", 1))
+        self.assertEqual(self.uses(), 1)
+        self.assertEqual(self.balance(), (1, 0))
+        self.assertEqual(CreditBalance.ledger_total(self.user.pk), 1)
+        self.assertFalse(CreditHold.objects.exists())
+
+    def test_release_returns_the_credit(self):
+        hold = CreditHold.place(self.user)
+
+        hold.release()
+        hold.release()
+
+        self.assertEqual(self.balance(), (2, 0))
+        self.assertEqual(self.uses(), 0)
+        self.assertFalse(CreditHold.objects.exists())
+
+    def test_release_expired_sweeps_only_expired_holds(self):
+        expired = CreditHold.place(self.user)
+        CreditHold.place(self.user)
+        self.expire(expired)
+
+        self.assertEqual(CreditHold.release_expired(), 1)
+
+        self.assertEqual(self.balance(), (2, 1))
+        self.assertFalse(CreditHold.objects.filter(pk=expired.pk).exists())
+        self.assertEqual(CreditHold.objects.count(), 1)
+
+    def test_commit_after_the_sweeper_took_the_hold(self):
+        hold = CreditHold.place(self.user)
+        self.expire(hold)
+        CreditHold.release_expired()
+        self.assertEqual(self.balance(), (2, 0))
+
+        hold.commit()
+
+        # Charged through the ledger instead, still exactly once
+        self.assertEqual(self.uses(), 1)
+        self.assertEqual(self.balance(), (1, 0))
+        self.assertEqual(CreditBalance.ledger_total(self.user.pk), 1)
+
+    def test_release_after_a_rolled_back_commit(self):
+        hold = CreditHold.place(self.user)
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                hold.commit()
+                raise RuntimeError("a later save failed")
+        hold.release()
+
+        self.assertEqual(self.uses(), 0)
+        self.assertEqual(self.balance(), (2, 0))
+        self.assertFalse(CreditHold.objects.exists())
@@ -100,14 +100,95 @@ DATABASES = {
 
 # Redis configuration
 import redis
+from redis.backoff import NoBackoff
+from redis.retry import Retry
 
 REDIS_CLIENT = redis.StrictRedis(
-    host='redis',          # Docker service name
-    port=6379,
+    host=os.getenv('REDIS_HOST', 'redis'),          # Docker service name
+    port=int(os.getenv('REDIS_PORT', '6379')),
     db=0,
-    decode_responses=True
+    decode_responses=True,
+    # Request-path helpers fall back to the database when Redis is slow or down,
+    # so fail fast instead of retrying with backoff
+    socket_connect_timeout=0.5,
+    socket_timeout=0.5,
+    retry=Retry(NoBackoff(), 0),
 )
 
+# Circuit breaker around the AI backend (state shared through Redis)
+AI_BREAKER_WINDOW_SECONDS = int(os.getenv('AI_BREAKER_WINDOW_SECONDS', '60'))
+AI_BREAKER_BUCKET_SECONDS = int(os.getenv('AI_BREAKER_BUCKET_SECONDS', '10'))
+AI_BREAKER_MIN_CALLS = int(os.getenv('AI_BREAKER_MIN_CALLS', '10'))
+AI_BREAKER_ERROR_RATE = float(os.getenv('AI_BREAKER_ERROR_RATE', '0.5'))
+AI_BREAKER_SLOW_CALL_SECONDS = float(os.getenv('AI_BREAKER_SLOW_CALL_SECONDS', '20'))
+AI_BREAKER_SLOW_CALL_RATE = float(os.getenv('AI_BREAKER_SLOW_CALL_RATE', '0.8'))
+AI_BREAKER_OPEN_SECONDS = int(os.getenv('AI_BREAKER_OPEN_SECONDS', '30'))
+
+# Image uploads are spooled to disk and refused above this size
+AI_UPLOAD_MAX_BYTES = int(os.getenv('AI_UPLOAD_MAX_BYTES', str(15 * 1024 * 1024)))
+
+# Uploads are re-encoded before being forwarded to the AI backend
+AI_IMAGE_NORMALIZE = os.getenv('AI_IMAGE_NORMALIZE', 'True').lower() == 'true'
+AI_IMAGE_MAX_EDGE = int(os.getenv('AI_IMAGE_MAX_EDGE', '1280'))  # pixels, longest side
+AI_IMAGE_JPEG_QUALITY = int(os.getenv('AI_IMAGE_JPEG_QUALITY', '85'))
+
+# Local quality gate: reject unusable photos before calling the AI backend
+AI_QUALITY_GATE = os.getenv('AI_QUALITY_GATE', 'True').lower() == 'true'
+AI_QUALITY_MIN_EDGE = int(os.getenv('AI_QUALITY_MIN_EDGE', '256'))  # pixels, shortest side
+AI_QUALITY_MIN_SHARPNESS = float(os.getenv('AI_QUALITY_MIN_SHARPNESS', '15'))  # variance of the Laplacian
+AI_QUALITY_MIN_BRIGHTNESS = float(os.getenv('AI_QUALITY_MIN_BRIGHTNESS', '35'))  # mean luma, 0-255
+AI_QUALITY_MAX_BRIGHTNESS = float(os.getenv('AI_QUALITY_MAX_BRIGHTNESS', '225'))
+AI_QUALITY_FACE_CHECK = os.getenv('AI_QUALITY_FACE_CHECK', 'False').lower() == 'true'  # needs opencv
+
+# Per-user digest -> stored analysis cache for re-uploaded images
+AI_RESULT_CACHE_TTL = int(os.getenv('AI_RESULT_CACHE_TTL', '86400'))  # seconds
+AI_RESULT_CACHE_MAX_ENTRIES = int(os.getenv('AI_RESULT_CACHE_MAX_ENTRIES', '50'))  # per user
+
+# Per-user cache of user-dashboard/, progress-data/, score-history/ and detailed-metrics/
+AI_DASHBOARD_CACHE_SECONDS = int(os.getenv('AI_DASHBOARD_CACHE_SECONDS', '300'))  # 0 disables
+
+# Identical scans in flight at the same time wait for the first one's result
+AI_COALESCE_WAIT_SECONDS = int(os.getenv('AI_COALESCE_WAIT_SECONDS', '30'))
+
+# Scan rate limits shared by all workers through Redis: "<count>/<s|min|hour|day>", empty for none
+import json
+AI_SCAN_RATE_USER = os.getenv('AI_SCAN_RATE_USER', '10/min')
+AI_SCAN_RATE_GLOBAL = os.getenv('AI_SCAN_RATE_GLOBAL', '600/min')  # all users together
+AI_SCAN_RATE_PLANS = json.loads(os.getenv('AI_SCAN_RATE_PLANS', '{}'))  # plan name -> rate, e.g. {"Pro": "30/min"}
+
+# AI backend HTTP client
+# Each sync gunicorn thread holds one AI connection at a time, or up to
+# AI_BATCH_CONCURRENCY while serving analyze-image/batch/, so that bounds the
+# per-process pool.
+BASE_URL_AI = os.getenv('BASE_URL_AI')
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', '2'))
+AI_BATCH_MAX_IMAGES = int(os.getenv('AI_BATCH_MAX_IMAGES', '5'))
+AI_BATCH_CONCURRENCY = int(os.getenv('AI_BATCH_CONCURRENCY', '3'))
+AI_POOL_MAXSIZE = int(os.getenv('AI_POOL_MAXSIZE', str(GUNICORN_THREADS * AI_BATCH_CONCURRENCY)))
+AI_CONNECT_TIMEOUT = float(os.getenv('AI_CONNECT_TIMEOUT', '3.05'))
+AI_READ_TIMEOUT = float(os.getenv('AI_READ_TIMEOUT', '60'))
+AI_MAX_RETRIES = int(os.getenv('AI_MAX_RETRIES', '2'))
+AI_RETRY_BACKOFF = float(os.getenv('AI_RETRY_BACKOFF', '0.3'))
+AI_RETRY_JITTER = float(os.getenv('AI_RETRY_JITTER', '0.3'))
+
+# AI inference replicas; calls go to the healthy one with the fewest requests
+# in flight (see ai/endpoint_pool.py). Defaults to the single BASE_URL_AI.
+AI_ENDPOINTS = [
+    url.strip()
+    for url in os.getenv('AI_ENDPOINTS', BASE_URL_AI or '').split(',')
+    if url.strip()
+]
+AI_ENDPOINT_FAILOVER = int(os.getenv('AI_ENDPOINT_FAILOVER', '1'))  # extra endpoints tried when one is unreachable
+AI_ENDPOINT_MAX_FAILURES = int(os.getenv('AI_ENDPOINT_MAX_FAILURES', '3'))
+AI_ENDPOINT_SLOW_SECONDS = float(os.getenv('AI_ENDPOINT_SLOW_SECONDS', '20'))
+AI_ENDPOINT_EJECT_SECONDS = int(os.getenv('AI_ENDPOINT_EJECT_SECONDS', '30'))
+AI_HEALTH_CHECK_PATH = os.getenv('AI_HEALTH_CHECK_PATH', '/health')
+AI_HEALTH_CHECK_TIMEOUT = float(os.getenv('AI_HEALTH_CHECK_TIMEOUT', '2'))
+AI_HEALTH_CHECK_INTERVAL = int(os.getenv('AI_HEALTH_CHECK_INTERVAL', '10'))  # seconds, run by celery beat
+
+# Connections the async client may hold per event loop (ASGI profile only)
+AI_ASYNC_MAX_CONNECTIONS = int(os.getenv('AI_ASYNC_MAX_CONNECTIONS', '200'))
+
 # Session expires after 1 day
 SESSION_COOKIE_AGE = 86400  # 1 day
 SESSION_SAVE_EVERY_REQUEST = False
@@ -316,9 +397,32 @@ ACCOUNT_EMAIL_VERIFICATION = os.getenv('ACCOUNT_EMAIL_VERIFICATION', 'mandatory'
 SOCIALACCOUNT_ADAPTER = 'accounts.adapter.MySocialAccountAdapter'
 
 # Celery Configuration
-# CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://127.0.0.1:6379/0')
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://127.0.0.1:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://127.0.0.1:6379/0')
 
+# Background image analysis runs on its own queue so AI workers scale
+# independently of the default worker (see `ai-worker` in docker-compose.yml)
+CELERY_TASK_ROUTES = {
+    'ai.tasks.run_analysis_job': {'queue': 'analysis'},
+}
+CELERY_BEAT_SCHEDULE = {
+    'check-ai-endpoints': {
+        'task': 'ai.tasks.check_ai_endpoints',
+        'schedule': AI_HEALTH_CHECK_INTERVAL,
+        'options': {'expires': AI_HEALTH_CHECK_INTERVAL},
+    },
+    'release-expired-credit-holds': {
+        'task': 'payment.tasks.release_expired_credit_holds',
+        'schedule': 60,
+        'options': {'expires': 60},
+    },
+}
+AI_JOB_MAX_RETRIES = int(os.getenv('AI_JOB_MAX_RETRIES', '5'))
+AI_JOB_RETRY_BACKOFF = int(os.getenv('AI_JOB_RETRY_BACKOFF', '10'))  # seconds, doubled per retry
+
+# Credits are held for the length of an analysis; holds older than this are released
+CREDIT_HOLD_SECONDS = int(os.getenv('CREDIT_HOLD_SECONDS', '300'))
+
 
 # for Google OAuth (social login)
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')